@@ -45,22 +45,38 @@ except:
 import usb1
 
 import binascii
+import copy
+import os
+import stat
+import struct
 import argparse
-from time import sleep
+import string
+from collections import OrderedDict, deque
+from time import sleep, monotonic
 import traceback
 
 try:
     from pydbus import SystemBus, SessionBus
     from pydbus.generic import signal
+    from pydbus.registration import ObjectWrapper, ObjectRegistration
+    from gi.repository import Gio
 except ImportError:
     print("pydbus library not installed. Service will not work.");
 
+    def signal():
+        """Stand-in for pydbus.generic.signal, so the service class can still be defined"""
+        return None
+
+    ObjectWrapper = object  # Stand-in for pydbus.registration.ObjectWrapper
+
 try:
     from gi.repository import GLib
 except ImportError:
     import glib as GLib
 
-from threading import Semaphore
+from threading import Condition, Lock, RLock, Thread, current_thread, main_thread
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 
 app_version = "0.1"
 
@@ -77,6 +93,7 @@ class UsbBackend(object):
 
     TYPE_PYUSB = 'pyusb'
     TYPE_USB1  = 'usb1'
+    TYPE_FAKE  = 'fake'
 
     TYPE_DEFAULT = TYPE_USB1
 
@@ -107,6 +124,10 @@ class UsbBackend(object):
         """"""
         raise NotImplemented()
 
+    def is_alive(self):
+        """Cheap health check of an open device handle"""
+        return self.device is not None
+
     def send_data(self, bm_request_type, bm_request, w_value, data):
         """"""
         pass
@@ -115,9 +136,27 @@ class UsbBackend(object):
         """"""
         pass
 
-    def handle_events(self):
+    def cancel_interrupt(self, transfer):
+        """"""
+        pass
+
+    def handle_events(self, timeout=0):
+        """Handles pending events, waits at most timeout seconds for one to arrive"""
         pass
 
+    @staticmethod
+    def as_binary(data):
+        """Commands are passed either as binary packets or in hex format"""
+        if isinstance(data, str):
+            return binascii.unhexlify(data)
+        return data
+
+    @staticmethod
+    def as_hex(data):
+        if isinstance(data, str):
+            return data
+        return binascii.hexlify(data).decode("ascii")
+
     def _log(self, msg):
         if self.verbose:
             print(msg)
@@ -160,10 +199,21 @@ class UsbBackendPyUsb(UsbBackend):
         if self.is_detached:
             self.device.attach_kernel_driver(self.w_index)
 
+    def is_alive(self):
+        if self.device is None:
+            return False
+        try:
+            self.device.get_active_configuration()
+        except usb.core.USBError as ex:
+            self._log("Device is not responding: {}".format(ex))
+            return False
+        return True
+
     def send_data(self, bm_request_type, bm_request, w_value, data):
         # decode data to binary and send it
-        self._log(">> '{}'".format(data))
-        self.device.ctrl_transfer(bm_request_type, bm_request, w_value, self.w_index, binascii.unhexlify(data), 1000)
+        if self.verbose:
+            self._log(">> '{}'".format(self.as_hex(data)))
+        self.device.ctrl_transfer(bm_request_type, bm_request, w_value, self.w_index, self.as_binary(data), 1000)
 
     def read_interrupt(self, endpoint, length, callback=None, user_data=None, timeout=0):
         """"""
@@ -244,14 +294,18 @@ class UsbBackendUsb1(UsbBackend):
         except Exception as ex:
             self._log("Exception while releasing interface: {}".format(ex))
         finally:
-            # self.context.
-            # self.device.close()
-            pass
+            self.interface = None
 
         # reattach kernel driver, otherwise special key will not work
         if self.is_detached:
             self._log("Attaching kernel on interface {}".format(self.w_index))
-            self.device.attachKernelDriver(self.w_index)
+            try:
+                self.device.attachKernelDriver(self.w_index)
+            except usb1.USBError as ex:
+                # e.g. the device has been unplugged in the meantime
+                self._log("Exception while attaching kernel: {}".format(ex))
+            finally:
+                self.is_detached = False
 
         if self.device is not None:
             self.device.close()
@@ -265,10 +319,21 @@ class UsbBackendUsb1(UsbBackend):
         """"""
         return self.device.claimInterface(self.w_index)
 
+    def is_alive(self):
+        if self.device is None:
+            return False
+        try:
+            self.device.getConfiguration()
+        except usb1.USBError as ex:
+            self._log("Device is not responding: {}".format(ex))
+            return False
+        return True
+
     def send_data(self, bm_request_type, bm_request, w_value, data):
         # decode data to binary and send it
-        self._log("Send >> '{}'".format(data))
-        self.device.controlWrite(bm_request_type, bm_request, w_value, self.w_index, binascii.unhexlify(data), 1000)
+        if self.verbose:
+            self._log("Send >> '{}'".format(self.as_hex(data)))
+        self.device.controlWrite(bm_request_type, bm_request, w_value, self.w_index, self.as_binary(data), 1000)
 
     def read_interrupt(self, endpoint, length, callback=None, user_data=None, timeout=0):
         """"""
@@ -277,13 +342,131 @@ class UsbBackendUsb1(UsbBackend):
         transfer.submit()
         return transfer
 
+    def cancel_interrupt(self, transfer):
+        """"""
+        try:
+            transfer.cancel()
+        except usb1.USBErrorNotFound:
+            pass  # already completed
+
     def handle_events(self, timeout=0):
-        self.context.handleEventsTimeout(timeout)
+        # blocks in libusb's poll until an event arrives or the timeout is reached
+        try:
+            self.context.handleEventsTimeout(timeout)
+        except usb1.USBErrorInterrupted:
+            pass
 
     def _assert_valid_usb_context(self):
         if self.context is None:
             self.context = usb1.USBContext()
 
+
+class UsbFakeTransfer(object):
+    """Interrupt transfer of UsbBackendFake"""
+
+    def __init__(self, callback=None, user_data=None):
+        """"""
+        self.callback = callback
+        self.user_data = user_data
+        self.due_at = None  # monotonic time the acknowledgement arrives, None until a packet was sent
+        self.status = usb1.TRANSFER_COMPLETED
+
+    def getUserData(self):
+        return self.user_data
+
+    def getStatus(self):
+        return self.status
+
+
+class UsbBackendFake(UsbBackend):
+    """
+    Stand-in for a device, e.g. for benchmarks without hardware. Records the sent packets, takes latency seconds per
+    control transfer and acknowledges a packet ack_delay seconds after it was sent with an interrupt.
+    """
+
+    def __init__(self, vendor_id, product_id, w_index, latency=0.0, ack_delay=0.0, acknowledge=True):
+        """
+        :param latency: float seconds a control transfer blocks
+        :param ack_delay: float seconds after a transfer until the interrupt arrives
+        :param acknowledge: bool False simulates a device whose interrupts never arrive
+        """
+        super(UsbBackendFake, self).__init__(vendor_id, product_id, w_index)
+        self.supports_interrupts = True
+        self.latency = latency
+        self.ack_delay = ack_delay
+        self.acknowledge = acknowledge
+        self.ack_status = usb1.TRANSFER_COMPLETED  # status the interrupt transfers complete with
+
+        self.present = True
+        self.packets = []  # (monotonic time, hex)[] of all sent packets
+        self.connects = 0
+        self.transfer = None  # type: UsbFakeTransfer
+
+    def get_usb_device(self):
+        if not self.present:
+            return None
+        return self
+
+    def connect(self, device=None):
+        if not self.present:
+            raise ValueError("USB device not found!")
+        self.device = self
+        self.connects = self.connects + 1
+        return self.device
+
+    def disconnect(self):
+        self.device = None
+        self.transfer = None
+
+    def is_alive(self):
+        return self.device is not None and self.present
+
+    def send_data(self, bm_request_type, bm_request, w_value, data):
+        if self.verbose:
+            self._log("Send >> '{}'".format(self.as_hex(data)))
+        if self.device is None:
+            raise ValueError("USB device not connected!")
+        if self.latency > 0:
+            sleep(self.latency)
+        self.packets.append((monotonic(), self.as_hex(data)))
+        if self.transfer is not None and self.acknowledge:
+            self.transfer.due_at = monotonic() + self.ack_delay
+            self.transfer.status = self.ack_status
+
+    def read_interrupt(self, endpoint, length, callback=None, user_data=None, timeout=0):
+        self.transfer = UsbFakeTransfer(callback, user_data)
+        return self.transfer
+
+    def cancel_interrupt(self, transfer):
+        if transfer is self.transfer:
+            self.transfer = None
+
+    def handle_events(self, timeout=0):
+        transfer = self.transfer
+        if transfer is None or transfer.due_at is None:
+            sleep(timeout)
+            return
+
+        remaining = transfer.due_at - monotonic()
+        if remaining > timeout:
+            sleep(timeout)
+            return
+        if remaining > 0:
+            sleep(remaining)
+
+        self.transfer = None
+        if transfer.callback is not None:
+            transfer.callback(transfer)
+
+    def get_packets(self):
+        """
+        :return: str[] hex of the sent packets
+        """
+        return [packet for sent_at, packet in self.packets]
+
+    def clear_packets(self):
+        self.packets = []
+
 # GDevices --------------------------------------------------------------------
 
 class GDeviceRegistry(object):
@@ -291,6 +474,9 @@ class GDeviceRegistry(object):
 
     STATE_FILE_EXTENSION = ".gstate"
 
+    # Seconds after which the cached presence of devices is refreshed by a rescan
+    DEFAULT_RESCAN_INTERVAL = 5
+
     def __init__(self, backend_type=UsbBackend.TYPE_DEFAULT, verbose=False, strict_filenames=True):
         """"""
         self.verbose = verbose
@@ -299,6 +485,24 @@ class GDeviceRegistry(object):
         self.known_devices = []
         self.init_known_devices()
 
+        # state file
+        self.restore_latencies = {}  # device_name_short -> seconds the last restore took
+        self.state_format = GDeviceStateCodec.FORMAT_JSON
+        self.saved_states = {}  # device_name_short -> state dict as last loaded or written
+        self.saved_filename = None
+        self.saved_format = None  # GDeviceStateCodec.FORMAT_* of the state file as last loaded or written
+
+        # cached enumeration
+        self.presence_lock = Lock()
+        self.rescan_interval = self.DEFAULT_RESCAN_INTERVAL
+        self.presence = None  # device_name_short -> bool, None until the first scan
+        self.scanned_at = None
+        self.presence_listeners = []
+
+        # hotplug notifications
+        self.hotplug_context = None  # type: usb1.USBContext
+        self.hotplug_handles = []
+
     def init_known_devices(self):
         self.known_devices = [G203(self.backend_type), G213(self.backend_type)]
         for known_device in self.known_devices:
@@ -306,13 +510,18 @@ class GDeviceRegistry(object):
 
     def find_devices(self):
         """
+        Returns the present devices from the cached enumeration, which is refreshed by hotplug events or a rescan
         :return: GDevice[]
         """
+        if self.presence is None or self.scanned_at is None \
+                or monotonic() - self.scanned_at >= self.rescan_interval:
+            self.rescan()
 
         found_devices = []
-        for known_device in self.known_devices:
-            if known_device.exists():
-                found_devices.append(known_device)
+        with self.presence_lock:
+            for known_device in self.known_devices:
+                if self.presence.get(known_device.device_name_short, False):
+                    found_devices.append(known_device)
 
         return found_devices
 
@@ -323,6 +532,88 @@ class GDeviceRegistry(object):
                 return found_device
         return None
 
+    def rescan(self):
+        """Probes all known devices and updates the cached enumeration"""
+        for known_device in self.known_devices:
+            self.set_presence(known_device, known_device.exists())
+        self.scanned_at = monotonic()
+
+    def invalidate(self):
+        """Forces a rescan on the next lookup, e.g. after a cached device could not be opened"""
+        self.scanned_at = None
+
+    def set_presence(self, device, present):
+        """
+        :param device: GDevice
+        :param present: bool
+        """
+        device_name = device.device_name_short
+        with self.presence_lock:
+            if self.presence is None:
+                self.presence = {}
+            was_present = self.presence.get(device_name)
+            self.presence[device_name] = present
+
+        if was_present is not None and was_present != present:
+            self._log("Device '{}' has been {}".format(device_name, "added" if present else "removed"))
+            for listener in self.presence_listeners:
+                listener(device, present)
+
+    def add_presence_listener(self, callback):
+        """
+        :param callback: callable(GDevice, bool) called whenever a device is added or removed
+        """
+        self.presence_listeners.append(callback)
+
+    def enable_hotplug(self):
+        """
+        Registers libusb hotplug callbacks for the known devices. The events are processed by handle_hotplug_events()
+        which should be called whenever one of the get_hotplug_poll_fds() becomes ready.
+        :return: bool False if hotplug notifications are not supported
+        """
+        if self.hotplug_context is not None:
+            return True
+        if self.backend_type != UsbBackend.TYPE_USB1 or not usb1.hasCapability(usb1.CAP_HAS_HOTPLUG):
+            return False
+
+        self.hotplug_context = usb1.USBContext()
+        for known_device in self.known_devices:
+            handle = self.hotplug_context.hotplugRegisterCallback(
+                self.on_hotplug,
+                flags=0,  # no enumeration, the initial state comes from rescan()
+                vendor_id=known_device.id_vendor,
+                product_id=known_device.id_product)
+            self.hotplug_handles.append(handle)
+        return True
+
+    def disable_hotplug(self):
+        if self.hotplug_context is not None:
+            for handle in self.hotplug_handles:
+                self.hotplug_context.hotplugDeregisterCallback(handle)
+            self.hotplug_handles = []
+            self.hotplug_context.close()
+            self.hotplug_context = None
+
+    def get_hotplug_poll_fds(self):
+        """
+        :return: (fd, events)[] file descriptors to watch for hotplug events
+        """
+        if self.hotplug_context is None:
+            return []
+        return self.hotplug_context.getPollFDList()
+
+    def handle_hotplug_events(self):
+        if self.hotplug_context is not None:
+            self.hotplug_context.handleEventsTimeout(0)
+
+    def on_hotplug(self, context, usb_device, event):
+        # called from within libusb's event handling, so no synchronous usb calls in here
+        for known_device in self.known_devices:
+            if known_device.id_vendor == usb_device.getVendorID() \
+                    and known_device.id_product == usb_device.getProductID():
+                self.set_presence(known_device, event == usb1.HOTPLUG_EVENT_DEVICE_ARRIVED)
+        return False  # keep the callback registered
+
     def get_known_device(self, short_name_filter=None):
         for known_device in self.known_devices:
             if known_device.device_name_short == short_name_filter:
@@ -336,54 +627,156 @@ class GDeviceRegistry(object):
         return states
 
     def set_state_of_devices(self, states):
-        states = {}
+        """
+        Applies the states as deltas, attributes missing in a state keep their value
+        :param states: dict device_name_short -> state dict or GDeviceState
+        :return: GDevice[] devices whose state changed
+        """
+        changed_devices = []
         for known_device in self.known_devices:
             if known_device.device_name_short in states:
-                known_device.device_state.import_dict(states[known_device.device_name_short])
+                if known_device.apply_state(states[known_device.device_name_short]):
+                    changed_devices.append(known_device)
+        return changed_devices
 
-    def restore_states_of_devices(self):
-        for known_device in self.known_devices:
-            device_name = known_device.device_name_short
-            try:
-                known_device.restore_state()
-            except Exception as ex:
-                print("Could not restore state of device '{}'".format(device_name))
-                print("Exception: {}".format(ex))
-                if self.verbose:
-                    print(traceback.format_exc())
+    def restore_states_of_devices(self, parallel=True, devices=None):
+        """
+        Restores the devices concurrently, so restoring takes about as long as the slowest device
+        :param parallel: restore one device after the other if False
+        :param devices: GDevice[] to restore, all known devices if None
+        :return: dict device_name_short -> seconds the restore took
+        """
+        if devices is None:
+            devices = self.known_devices
+
+        if parallel and len(devices) > 1:
+            with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+                latencies = list(executor.map(self.restore_state_of_device, devices))
+        else:
+            latencies = [self.restore_state_of_device(known_device) for known_device in devices]
+
+        for known_device, latency in zip(devices, latencies):
+            self.restore_latencies[known_device.device_name_short] = latency
+        return dict((known_device.device_name_short, latency) for known_device, latency in zip(devices, latencies))
+
+    def restore_state_of_device(self, known_device):
+        """
+        :return: float seconds the restore took
+        """
+        device_name = known_device.device_name_short
+        started_at = monotonic()
+        try:
+            known_device.restore_state()
+        except Exception as ex:
+            print("Could not restore state of device '{}'".format(device_name))
+            print("Exception: {}".format(ex))
+            if self.verbose:
+                print(traceback.format_exc())
+
+        latency = monotonic() - started_at
+        self._log("Restored state of device '{}' in {:.1f} ms".format(device_name, latency * 1000))
+        return latency
 
     def load_state_from_json(self, state_json):
+        """
+        :return: GDevice[] devices whose state changed
+        """
         state_data = json.loads(state_json)
+        changed_devices = []
         for known_device in self.known_devices:
             device_name = known_device.device_name_short
             if device_name in state_data:
                 try:
-                    known_device.device_state.import_dict(state_data[device_name])
+                    if known_device.apply_state(state_data[device_name]):
+                        changed_devices.append(known_device)
                 except Exception as ex:
                     print("Could not restore state of device '{}'".format(device_name))
                     print("Exception: {}".format(ex))
                     if self.verbose:
                         print(traceback.format_exc())
+        return changed_devices
 
 
     def load_state_of_devices(self, filename):
-        """"""
-        state = self.get_state_of_devices()
+        """Loads a state file in json or in the binary format"""
+        with open(filename, "rb") as fh:
+            state_data = fh.read()
 
-        fh = open(filename, "r")
-        state_json = fh.read()
-        fh.close()
+        if GDeviceStateCodec.is_binary(state_data):
+            self.set_state_of_devices(GDeviceStateCodec.decode(state_data))
+            self.saved_format = GDeviceStateCodec.FORMAT_BINARY
+        else:
+            self.load_state_from_json(state_data.decode("utf-8"))
+            self.saved_format = GDeviceStateCodec.FORMAT_JSON
 
-        self.load_state_from_json(state_json)
+        self.saved_states = copy.deepcopy(self.get_state_of_devices())
+        self.saved_filename = filename
 
-    def write_state_of_devices(self, filename):
-        """"""
+    def get_dirty_devices(self):
+        """
+        :return: str[] names of the devices whose state changed since the state file was loaded or written
+        """
+        return [device_name for device_name, state in self.get_state_of_devices().items()
+                if self.saved_states.get(device_name) != state]
+
+    def write_state_of_devices(self, filename, force=False):
+        """
+        Writes the state file atomically, unless no device state changed since it was last loaded or written
+        :param force: write even if no device state changed
+        :return: bool whether the file was written
+        """
         self._assert_valid_state_filename(filename)
-        state_json = self.get_state_as_json()
 
-        fh = open(filename, "w")
-        fh.write(state_json)
-        fh.close()
+        # a file in the other format is converted even if no device state changed
+        if not force and filename == self.saved_filename and self.saved_format == self.state_format \
+                and os.path.exists(filename) and len(self.get_dirty_devices()) == 0:
+            self._log("State of devices unchanged, not writing '{}'".format(filename))
+            return False
+
+        states = copy.deepcopy(self.get_state_of_devices())
+        if self.state_format == GDeviceStateCodec.FORMAT_BINARY:
+            state_data = GDeviceStateCodec.encode(states)
+        else:
+            state_data = json.dumps(states, indent=4).encode("utf-8")
+
+        GDeviceRegistry.write_file_atomically(filename, state_data)
+        self.saved_states = states
+        self.saved_filename = filename
+        self.saved_format = self.state_format
+        return True
+
+    @staticmethod
+    def write_file_atomically(filename, data):
+        """
+        Writes to a temporary file next to the target, syncs it and renames it over the target. The target keeps its
+        mode, a new file gets the mode open() would give it.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        tmp_filename = os.path.join(directory, ".{}.{}.tmp".format(
+            os.path.basename(filename), binascii.hexlify(os.urandom(4)).decode("ascii")))
+        # unlike mkstemp() (always 0600) this honours the umask like open() does
+        fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                if os.path.exists(filename):
+                    os.fchmod(fh.fileno(), stat.S_IMODE(os.stat(filename).st_mode))
+                fh.write(data)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_filename, filename)
+        except:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+            raise
+
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass  # not every file system syncs directories
 
     def get_state_as_json(self):
         return json.dumps(self.get_state_of_devices(), indent=4)
@@ -393,6 +786,10 @@ class GDeviceRegistry(object):
             if not filename.endswith(self.STATE_FILE_EXTENSION):
                 raise GDeviceException("Invalid filename! Must end with '{}'".format(self.STATE_FILE_EXTENSION))
 
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
+
 
 class GDeviceState(object):
 
@@ -434,6 +831,17 @@ class GDeviceState(object):
         self.resize_colors(index+1)
         self.colors[index] = color
 
+    def get_field_colors(self, count):
+        """
+        Colors shown by fields 1..count, None if the color of a field is not known
+        :return: str[]
+        """
+        if not self.static or self.colors is None:
+            return [None] * count
+        if self.colors_uniform:
+            return [self.colors[0]] * count
+        return [self.colors[i] if len(self.colors) > i else None for i in range(1, count + 1)]
+
     def import_dict(self, values):
         for attr in self.attrs:
             if attr in values:
@@ -445,8 +853,131 @@ class GDeviceState(object):
         data = {}
         for attr in self.attrs:
             data[attr] = self.__getattribute__(attr)
+        if self.colors is not None:
+            data["colors"] = list(self.colors)  # snapshots must not change with the state
         return data
 
+    @staticmethod
+    def get_delta(data, previous):
+        """
+        Attributes which differ from an earlier snapshot
+        :param data: dict from as_dict()
+        :param previous: dict from as_dict(), None if there is none
+        :return: dict
+        """
+        if previous is None:
+            return data
+        return dict((attr, value) for attr, value in data.items() if attr not in previous or previous[attr] != value)
+
+
+class GDeviceStateCodec(object):
+    """
+    Compact binary state file: magic, version, device count and per device its name, flags, brightness, speed and
+    colors. Colors are stored as a presence byte plus rgb, so unset fields survive.
+    """
+
+    FORMAT_JSON = "json"
+    FORMAT_BINARY = "binary"
+
+    MAGIC = b"GLST"
+    VERSION = 1
+
+    FLAG_COLORS_UNIFORM = 0x01
+    FLAG_STATIC = 0x02
+    FLAG_BREATHING = 0x04
+    FLAG_CYCLING = 0x08
+    FLAG_HAS_COLORS = 0x10
+    FLAG_HAS_BRIGHTNESS = 0x20
+    FLAG_HAS_SPEED = 0x40
+
+    HEADER = struct.Struct(">4sBH")
+    DEVICE = struct.Struct(">BIIB")  # flags, brightness, speed, number of colors
+
+    @staticmethod
+    def is_binary(data):
+        return data.startswith(GDeviceStateCodec.MAGIC)
+
+    @staticmethod
+    def encode(states):
+        """
+        :param states: dict device_name_short -> GDeviceState.as_dict()
+        :return: bytes
+        """
+        data = bytearray(GDeviceStateCodec.HEADER.pack(GDeviceStateCodec.MAGIC, GDeviceStateCodec.VERSION, len(states)))
+        for device_name in sorted(states.keys()):
+            state = states[device_name]
+            name = device_name.encode("utf-8")
+            colors = state.get("colors") or []
+
+            flags = 0
+            for attr, flag in [("colors_uniform", GDeviceStateCodec.FLAG_COLORS_UNIFORM),
+                               ("static", GDeviceStateCodec.FLAG_STATIC),
+                               ("breathing", GDeviceStateCodec.FLAG_BREATHING),
+                               ("cycling", GDeviceStateCodec.FLAG_CYCLING)]:
+                if state.get(attr):
+                    flags = flags | flag
+            if state.get("colors") is not None:
+                flags = flags | GDeviceStateCodec.FLAG_HAS_COLORS
+            if state.get("brightness") is not None:
+                flags = flags | GDeviceStateCodec.FLAG_HAS_BRIGHTNESS
+            if state.get("speed") is not None:
+                flags = flags | GDeviceStateCodec.FLAG_HAS_SPEED
+
+            data.append(len(name))
+            data.extend(name)
+            data.extend(GDeviceStateCodec.DEVICE.pack(
+                flags, state.get("brightness") or 0, state.get("speed") or 0, len(colors)))
+            for color in colors:
+                if color is None:
+                    data.extend(b"\x00\x00\x00\x00")
+                else:
+                    data.append(1)
+                    data.extend(binascii.unhexlify(color[0:6]))
+
+        return bytes(data)
+
+    @staticmethod
+    def decode(data):
+        """
+        :param data: bytes
+        :return: dict device_name_short -> state dict
+        """
+        magic, version, count = GDeviceStateCodec.HEADER.unpack_from(data, 0)
+        if magic != GDeviceStateCodec.MAGIC:
+            raise GDeviceException("Not a binary state file")
+        if version > GDeviceStateCodec.VERSION:
+            raise GDeviceException("Unsupported state file version {}".format(version))
+
+        states = {}
+        offset = GDeviceStateCodec.HEADER.size
+        for i in range(0, count):
+            name_length = data[offset]
+            device_name = data[offset + 1:offset + 1 + name_length].decode("utf-8")
+            offset = offset + 1 + name_length
+
+            flags, brightness, speed, color_count = GDeviceStateCodec.DEVICE.unpack_from(data, offset)
+            offset = offset + GDeviceStateCodec.DEVICE.size
+
+            colors = []
+            for j in range(0, color_count):
+                if data[offset]:
+                    colors.append(binascii.hexlify(data[offset + 1:offset + 4]).decode("ascii"))
+                else:
+                    colors.append(None)
+                offset = offset + 4
+
+            states[device_name] = {
+                "colors": colors if flags & GDeviceStateCodec.FLAG_HAS_COLORS else None,
+                "colors_uniform": bool(flags & GDeviceStateCodec.FLAG_COLORS_UNIFORM),
+                "static": bool(flags & GDeviceStateCodec.FLAG_STATIC),
+                "breathing": bool(flags & GDeviceStateCodec.FLAG_BREATHING),
+                "cycling": bool(flags & GDeviceStateCodec.FLAG_CYCLING),
+                "brightness": brightness if flags & GDeviceStateCodec.FLAG_HAS_BRIGHTNESS else None,
+                "speed": speed if flags & GDeviceStateCodec.FLAG_HAS_SPEED else None
+            }
+
+        return states
+
 
 class GValueSpec(object):
 
@@ -456,13 +987,23 @@ class GValueSpec(object):
         self.max_value = max_value
         self.default_value = default_value
 
+    @property
+    def byte_length(self):
+        """Number of bytes a value takes in a binary command, e.g. 2 for '04x'"""
+        return int(self.format[:-1]) // 2
+
     def format_color_hex(self, value):
-        if value is None:
-            value = self.default_value
-        value = int(value, 16)
-        return self.format_num(value)
+        return self.format_num(self.clamp_color_hex(value))
 
     def format_num(self, value):
+        return format(self.clamp(value), self.format)
+
+    def clamp_color_hex(self, value):
+        if value is None:
+            return self.clamp(None)
+        return self.clamp(int(value, 16))
+
+    def clamp(self, value):
         if value is None:
             value = self.default_value
 
@@ -471,7 +1012,64 @@ class GValueSpec(object):
         elif self.max_value is not None and value > self.max_value:
             value = self.max_value
 
-        return format(value, self.format)
+        return value
+
+
+class GCommandTemplate(object):
+    """
+    A command in hex format (e.g. "11ff0c3a{field}01{color}02...") compiled once into a binary packet. Values are
+    patched in at the offsets of their placeholders and the last built packets are kept in a LRU cache.
+    """
+
+    DEFAULT_CACHE_SIZE = 64
+
+    def __init__(self, template, specs, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param template: str command in hex format with placeholders
+        :param specs: dict placeholder name -> GValueSpec
+        """
+        self.template = template
+        self.names = []
+        self.offsets = {}  # placeholder name -> (offset, length)
+
+        packet = bytearray()
+        for literal, name, _, _ in string.Formatter().parse(template):
+            packet.extend(binascii.unhexlify(literal))
+            if name is not None:
+                length = specs[name].byte_length
+                self.names.append(name)
+                self.offsets[name] = (len(packet), length)
+                packet.extend(bytes(length))
+
+        self.packet = bytes(packet)
+        self.buffer = bytearray(self.packet)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def build(self, **values):
+        """
+        :param values: int value for every placeholder, already clamped to its GValueSpec
+        :return: bytes
+        """
+        if len(self.names) == 0:
+            return self.packet
+
+        key = tuple(values[name] for name in self.names)
+        packet = self.cache.get(key)
+        if packet is not None:
+            self.cache.move_to_end(key)
+            return packet
+
+        view = memoryview(self.buffer)
+        for name, value in zip(self.names, key):
+            offset, length = self.offsets[name]
+            view[offset:offset + length] = value.to_bytes(length, "big")
+        packet = bytes(self.buffer)
+
+        self.cache[key] = packet
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return packet
 
 
 class GDeviceException(Exception):
@@ -482,9 +1080,76 @@ class GControllerException(Exception):
     """"""
 
 
+class GCommandPacer(object):
+    """
+    Learns the minimal gap a device needs between two commands. The gap grows whenever an acknowledgement
+    was missed and shrinks again slowly while the device keeps up.
+    """
+
+    def __init__(self, max_gap=0.05, min_gap=0.0, gap_step=0.001, max_missed_in_row=3):
+        """
+        :param max_gap: upper bound of the learned gap in seconds
+        :param min_gap: lower bound of the learned gap in seconds
+        :param gap_step: seconds the gap is lowered by per acknowledged command
+        :param max_missed_in_row: missed acknowledgements in a row after which the device is considered not to send
+                                  any, see is_failing()
+        """
+        self.max_gap = max_gap
+        self.min_gap = min_gap
+        self.gap_step = gap_step
+        self.max_missed_in_row = max_missed_in_row
+
+        self.gap = min_gap
+        self.last_command = None
+        self.missed = 0
+        self.missed_in_row = 0
+
+    def wait(self):
+        """Sleeps until the learned gap since the last command has passed"""
+        if self.last_command is not None and self.gap > 0:
+            remaining = self.last_command + self.gap - monotonic()
+            if remaining > 0:
+                sleep(remaining)
+
+    def on_command(self, acknowledged):
+        self.last_command = monotonic()
+        if acknowledged:
+            self.gap = max(self.min_gap, self.gap - self.gap_step)
+            self.missed_in_row = 0
+        else:
+            self.missed = self.missed + 1
+            self.missed_in_row = self.missed_in_row + 1
+            self.gap = min(self.max_gap, max(self.gap * 2, self.gap_step))
+
+    def is_failing(self):
+        """
+        :return: bool True if the last max_missed_in_row commands were not acknowledged, every further command would
+                 wait for the interrupt timeout
+        """
+        return self.missed_in_row >= self.max_missed_in_row
+
+    def reset(self):
+        self.gap = self.min_gap
+        self.last_command = None
+        self.missed = 0
+        self.missed_in_row = 0
+
+
 class GDevice(object):
     """Abstract G-Device"""
 
+    PACING_FIXED = "fixed"  # sleep the device timings after every command
+    PACING_ACK   = "ack"    # send the next command as soon as the device acknowledged the last one
+
+    # protocol states of a session
+    PROTOCOL_DISCONNECTED = "disconnected"
+    PROTOCOL_CONNECTED    = "connected"  # the next command needs a prepare packet
+    PROTOCOL_PREPARED     = "prepared"   # commands of the prepared mode can be sent right away
+
+    MODE_STATIC  = "static"
+    MODE_BREATHE = "breathe"
+    MODE_CYCLE   = "cycle"
+
     def __init__(self, backend_type=UsbBackend.TYPE_DEFAULT):
         """"""
         self.verbose = False;
@@ -502,6 +1167,7 @@ class GDevice(object):
         self.ep_inter    = None    # Interrupt Endpoint (e.g. 0x82)
 
         self.is_detached = False    # If kernel driver needs to be reattached
+        self.is_connected = False   # If the interface is claimed by us
 
         self.bm_request_type = 0x00   # Device specific
         self.bm_request      = 0x00   # Device specific
@@ -516,9 +1182,27 @@ class GDevice(object):
         self.timeout_after_prepare = 0
         self.timeout_after_cmd = 0
 
+        self.timeout_interrupt = 0.5  # max. seconds to wait for the interrupt acknowledging a command
+
+        self.pacing = GDevice.PACING_ACK
+        self.pacer  = GCommandPacer()
+
+        # protocol state machine, see send_data()
+        self.skip_redundant_prepare = True
+        self.protocol_state = GDevice.PROTOCOL_DISCONNECTED
+        self.prepared_mode  = None
+
+        # differential updates, see send_colors_command()
+        self.shown_colors = {}   # field -> color the device is known to show, field 0 if all fields show it
+        self.shown_effect = None  # (mode, speed, brightness, color) of the effect the device is known to run
+        self.color_tolerance = 0      # Max. difference per color channel for which a field is not resent
+
         # mutexes
+        self.connection_lock = RLock()  # guards opening, probing and closing the usb handle, e.g. against rescans
         self.wait_on_interrupt = False
         self.wait_lock = None
+        self.interrupt_transfer = None
+        self.interrupt_acknowledged = False  # If the transfer of the last interrupt completed
 
         # value specs
         self.field_spec  = GValueSpec("02x", 0, self.max_color_fields, 0)
@@ -532,6 +1216,9 @@ class GDevice(object):
         self.cmd_breathe = "{color}{speed}{bright}"
         self.cmd_cycle   = "{speed}{bright}"
 
+        # binary commands compiled from the ones above, see get_command()
+        self.commands = None
+
         self.interrupt_length = 20
 
     def _init_backend(self):
@@ -541,123 +1228,441 @@ class GDevice(object):
                 self.backend = UsbBackendPyUsb(self.id_vendor, self.id_product, self.w_index)
             elif self.backend_type == UsbBackend.TYPE_USB1:
                 self.backend = UsbBackendUsb1(self.id_vendor, self.id_product, self.w_index)
+            elif self.backend_type == UsbBackend.TYPE_FAKE:
+                self.backend = UsbBackendFake(self.id_vendor, self.id_product, self.w_index)
             else:
                 raise ValueError("Unknown Backend {}".format(self.backend_type))
 
+    def apply_state(self, state):
+        """
+        Imports the attributes given in state, the others keep their value
+        :param state: dict or GDeviceState, e.g. from GlightController.get_state()
+        :return: bool whether the state changed or is not known to be shown and has to be restored
+        """
+        if isinstance(state, GDeviceState):
+            state = state.as_dict()
+        elif not isinstance(state, dict):
+            raise GDeviceException("State of device '{}' must be a dict".format(self.device_name_short))
+
+        previous = self.device_state.as_dict()
+        previous_shown = self.get_shown_state()
+        try:
+            self.device_state.import_dict(state)
+            changed = self.get_shown_state() != previous_shown
+        except Exception:
+            # no half applied states
+            self.device_state.import_dict(previous)
+            raise
+
+        if changed:
+            return True
+
+        # e.g. a single color for a uniform state, which is kept expanded to all fields
+        self.device_state.import_dict(previous)
+
+        # e.g. the last restore failed or the device has been replugged
+        return not self.is_state_shown()
+
+    def is_state_shown(self):
+        """Whether the device is known to show device_state"""
+        state = self.device_state
+        if state.breathing:
+            return bool(state.colors) and self.is_effect_shown(
+                GDevice.MODE_BREATHE, state.speed, state.brightness, state.colors[0])
+        if state.cycling:
+            return self.is_effect_shown(GDevice.MODE_CYCLE, state.speed, state.brightness)
+        if not state.static or not state.colors:
+            return True  # nothing to restore
+        if self.max_color_fields == 0:
+            return GDevice.is_similar_color(self.shown_colors.get(0), state.colors[0])
+        return all(color is None or GDevice.is_similar_color(self.shown_colors.get(field), color)
+                   for field, color in enumerate(state.get_field_colors(self.max_color_fields), 1))
+
+    def get_shown_state(self):
+        """
+        :return: tuple of what restore_state() would send, equal for states that look the same on the device
+        """
+        state = self.device_state
+        first_color = state.colors[0] if state.colors is not None and len(state.colors) > 0 else None
+        return (state.static, state.breathing, state.cycling, state.speed, state.brightness, first_color,
+                tuple(state.get_field_colors(self.max_color_fields)))
+
     def restore_state(self):
         """"""
-        if self.exists():
-            if self.device_state is not None:
-                has_state = self.device_state.static or self.device_state.breathing or self.device_state.cycling
-
-                if has_state:
-                    if self.device_state.static and self.device_state.colors is not None:
-                        self.connect()
-                        try:
-                            if self.device_state.colors_uniform and len(self.device_state.colors) > 0:
-                                self.send_color_command(self.device_state.colors[0], 0)
-                            else:
-                                for i, color in enumerate(self.device_state.colors):
-                                    if color is not None:
-                                        self.send_color_command(color, i)
-                        finally:
-                            self.disconnect()
-
-                    elif self.device_state.breathing:
-                        self.connect()
-                        try:
-                            if self.device_state.colors is not None and len(self.device_state.colors) > 0:
-                                self.send_breathe_command(
-                                        self.device_state.colors[0],
-                                        self.device_state.speed,
-                                        self.device_state.brightness)
-                        finally:
-                            self.disconnect()
-
-                    elif self.device_state.cycling:
-                        self.connect()
-                        try:
-                            self.send_cycle_command(
-                                    self.device_state.speed,
-                                    self.device_state.brightness)
-                        finally:
-                            self.disconnect()
+        if self.device_state is None:
+            return
+
+        has_state = self.device_state.static or self.device_state.breathing or self.device_state.cycling
+        if not has_state:
+            return
+
+        self._init_backend()
+        # a device held open by a session keeps its connection, otherwise the handle of the probe is used
+        with self.connection_lock:
+            keep_connection = self.is_connected
+            if keep_connection:
+                if not self.backend.is_alive():
+                    return
+            else:
+                usb_device = self.backend.get_usb_device()
+                if usb_device is None:
+                    return
+                self.connect(usb_device)
+        try:
+            if self.device_state.static and self.device_state.colors is not None:
+                self.restore_static_colors()
+
+            elif self.device_state.breathing:
+                if self.device_state.colors is not None and len(self.device_state.colors) > 0:
+                    self.send_breathe_command(
+                            self.device_state.colors[0],
+                            self.device_state.speed,
+                            self.device_state.brightness)
+
+            elif self.device_state.cycling:
+                self.send_cycle_command(
+                        self.device_state.speed,
+                        self.device_state.brightness)
+        finally:
+            if not keep_connection:
+                self.disconnect()
+
+    def restore_static_colors(self):
+        """
+        Sends field 0 first and then only the fields showing another color, a uniform state is a single command
+        """
+        # sending changes the state, so work on a copy
+        colors = list(self.device_state.colors)
+        field_colors = self.device_state.get_field_colors(self.max_color_fields)
+        if len(colors) == 0:
+            return
+
+        if self.device_state.colors_uniform:
+            self.send_color_command(colors[0], 0)
+            return
+
+        if len(field_colors) > 0 and field_colors[0] is not None \
+                and all(GDevice.is_similar_color(color, field_colors[0]) for color in field_colors):
+            self.send_color_command(field_colors[0], 0)
+            return
+
+        base_color = colors[0]
+        if base_color is not None:
+            self.send_color_command(base_color, 0)
+        for field, color in enumerate(colors[1:], 1):
+            if color is not None and not GDevice.is_similar_color(color, base_color):
+                self.send_color_command(color, field)
 
     def exists(self):
         """"""
         self._init_backend()
-        return self.backend.get_usb_device() is not None
+        with self.connection_lock:
+            if self.is_connected:
+                # do not open a second handle for a device we already hold
+                return self.backend.is_alive()
+            return self.backend.get_usb_device() is not None
 
-    def connect(self):
-        """"""
+    def connect(self, usb_device=None):
+        """
+        :param usb_device: the device found by a probe of the backend, saves looking it up again
+        """
         self._init_backend()
-        self.backend.connect()
+        with self.connection_lock:
+            self.backend.connect(usb_device)
+            self.is_connected = True
+            self.protocol_state = GDevice.PROTOCOL_CONNECTED
+            self.prepared_mode = None
 
     def disconnect(self):
         """"""
-        self.backend.disconnect()
+        with self.connection_lock:
+            self.is_connected = False
+            self.protocol_state = GDevice.PROTOCOL_DISCONNECTED
+            self.prepared_mode = None
+            self.backend.disconnect()
+
+    def forget_shown_state(self):
+        """The device might not show what was sent to it anymore, e.g. after a failed command or a replug"""
+        self.shown_colors = {}
+        self.shown_effect = None
+
+    def reconnect(self):
+        """Drops a (possibly dead) connection and opens a new one"""
+        self.forget_shown_state()
+        with self.connection_lock:
+            try:
+                self.disconnect()
+            except Exception as ex:
+                self._log("Exception while disconnecting: {}".format(ex))
+            self.connect()
+
+    def is_alive(self):
+        """"""
+        with self.connection_lock:
+            return self.is_connected and self.backend.is_alive()
 
     def on_interrupt(self, sender):
+        if sender is not self.interrupt_transfer:
+            # late completion of a transfer we already gave up on
+            return
+        # timed out, cancelled or failed transfers end the wait, but do not acknowledge the command
+        self.interrupt_acknowledged = sender.getStatus() == usb1.TRANSFER_COMPLETED
         self.wait_on_interrupt = False
-        self._log("Received interrupt from sender: {}".format(sender))
+        self.interrupt_transfer = None
+        self._log("Received interrupt from sender: {} (acknowledged: {})".format(sender, self.interrupt_acknowledged))
 
     def _can_do_interrup(self):
         return self.backend.supports_interrupts and self.ep_inter is not None
 
     def begin_interrupt(self):
         if self._can_do_interrup():
-            self.backend.read_interrupt(endpoint=self.ep_inter, length=self.interrupt_length, callback=self.on_interrupt,
-                                        user_data=None, timeout=5000)
             self.wait_on_interrupt = True
+            self.interrupt_acknowledged = False
+            self.interrupt_transfer = self.backend.read_interrupt(
+                endpoint=self.ep_inter, length=self.interrupt_length, callback=self.on_interrupt,
+                user_data=None, timeout=int(self.timeout_interrupt * 1000))
 
-    def end_interrupt(self): # ChangeMe: stupid busy wait ...
-        if self._can_do_interrup():
-            max_iter = 10000
-            while self.wait_on_interrupt:
-                max_iter = max_iter-1
-                self.backend.handle_events()
-                if max_iter == 0:
-                    self._log("Did not get a interrupt response in time")
-                    # yield # hack ... works but why?
-                    return
+    def end_interrupt(self, timeout=None):
+        """
+        Waits until the interrupt of the last command arrives or the timeout has passed
+        :param timeout: float seconds, defaults to timeout_interrupt, 0 only handles the events already pending
+        :return: bool True if the interrupt was received and its transfer completed
+        """
+        if not self._can_do_interrup() or self.interrupt_transfer is None:
+            return False
 
-    def send_data(self, data):
-        if self.cmd_prepare is not None:
-            self.begin_interrupt()
-            self.backend.send_data(self.bm_request_type, self.bm_request, self.w_value, self.cmd_prepare)
-            sleep(self.timeout_after_prepare)
-            self.end_interrupt()
+        deadline = monotonic() + (self.timeout_interrupt if timeout is None else timeout)
+        while True:
+            remaining = deadline - monotonic()
+            self.backend.handle_events(max(remaining, 0))
+            if not self.wait_on_interrupt:
+                return self.interrupt_acknowledged
+            if remaining <= 0:
+                self._log("Did not get a interrupt response in time")
+                self.cancel_interrupt()
+                return False
+
+    def cancel_interrupt(self):
+        """Gives up on the interrupt of the last command, a late completion is ignored by on_interrupt()"""
+        transfer = self.interrupt_transfer
+        self.wait_on_interrupt = False
+        self.interrupt_transfer = None
+        if transfer is not None:
+            self.backend.cancel_interrupt(transfer)
+
+    def compile_commands(self):
+        """Compiles the hex commands of the device; needs to be called again if they or the value specs change"""
+        specs = {
+            "field":  self.field_spec,
+            "color":  self.color_spec,
+            "speed":  self.speed_spec,
+            "bright": self.bright_spec,
+        }
+        self.commands = {}
+        for name in ("prepare", "color", "breathe", "cycle"):
+            template = getattr(self, "cmd_" + name)
+            if template is not None:
+                self.commands[name] = GCommandTemplate(template, specs)
+
+    def get_command(self, name):
+        """
+        :param name: str prepare|color|breathe|cycle
+        :return: GCommandTemplate
+        """
+        if self.commands is None:
+            self.compile_commands()
+        return self.commands[name]
 
-        self.begin_interrupt()
-        self.backend.send_data(self.bm_request_type, self.bm_request, self.w_value, data)
-        sleep(self.timeout_after_cmd)
-        self.end_interrupt()
+    def needs_prepare(self, mode=None):
+        """The prepare packet is only needed after connecting, after a mode change or after an error"""
+        if self.cmd_prepare is None:
+            return False
+        if not self.skip_redundant_prepare:
+            return True
+        return self.protocol_state != GDevice.PROTOCOL_PREPARED or self.prepared_mode != mode
 
-    def send_colors_command(self, colors):
-        """"""
+    def send_data(self, data, mode=None):
+        try:
+            if self.needs_prepare(mode):
+                self.send_paced(self.get_command("prepare").build(), self.timeout_after_prepare)
+
+            acknowledged = self.send_paced(data, self.timeout_after_cmd)
+        except:
+            self._reset_protocol_state()
+            self.forget_shown_state()
+            raise
+
+        if acknowledged is False:
+            # the device might have dropped out of the prepared state
+            self._reset_protocol_state()
+        else:
+            self.protocol_state = GDevice.PROTOCOL_PREPARED
+            self.prepared_mode = mode
+
+    def _reset_protocol_state(self):
+        if self.protocol_state != GDevice.PROTOCOL_DISCONNECTED:
+            self.protocol_state = GDevice.PROTOCOL_CONNECTED
+        self.prepared_mode = None
+
+    def send_paced(self, data, timeout_after):
+        """
+        Sends a single packet. With ack pacing the call returns as soon as the device acknowledged the packet,
+        the fixed timeout is only slept if the backend has no interrupt support or the acknowledgement was missed.
+        A device missing several acknowledgements in a row is switched to fixed pacing, which does not wait for them.
+        :return: bool whether the packet was acknowledged, None if that is unknown
+        """
+        use_ack = self.pacing == self.PACING_ACK and self._can_do_interrup()
+
+        if use_ack:
+            self.pacer.wait()
+
+        self.begin_interrupt()
+        try:
+            self.backend.send_data(self.bm_request_type, self.bm_request, self.w_value, data)
+        except:
+            self.cancel_interrupt()
+            raise
+
+        if use_ack:
+            acknowledged = self.end_interrupt()
+            self.pacer.on_command(acknowledged)
+            if not acknowledged:
+                sleep(timeout_after)
+                if self.pacer.is_failing():
+                    print("Device '{}' does not acknowledge commands, using fixed pacing".format(
+                        self.device_name_short))
+                    self.pacing = self.PACING_FIXED
+            return acknowledged
+
+        sleep(timeout_after)
+        if self._can_do_interrup():
+            # the interrupt had the fixed timeout to arrive
+            return self.end_interrupt(timeout=0)
+        return None
+
+    def send_colors_command(self, colors, force=False):
+        """
+        Only fields whose color differs from the color the device is known to show are sent. A frame setting all
+        fields to the same color is sent as a single command for field 0.
+        :param colors: str[] one color for the whole device or one color per field
+        :param force: send every field regardless of the device state
+        """
+        frame = self.get_static_frame(colors)
+        if 0 in frame:
+            if force or not self.is_uniform_color_shown(frame[0]):
+                self.send_color_command(frame[0], 0)
+        else:
+            for color in frame.values():
+                GDevice.assert_valid_color(color)
+            self.send_field_colors(frame, force)
+
+    def get_static_frame(self, colors):
+        """
+        :param colors: str[] one color for the whole device or one color per field
+        :return: dict field -> color, a uniform frame only has field 0
+        """
         if len(colors) <= 1:
-            if len(colors) == 1:
-                color = colors[0]
-            else:
-                color = "FFFFFF"
+            return {0: colors[0] if len(colors) == 1 else "FFFFFF"}
 
-            self.send_color_command(color, 0)
+        colors = colors[0:self.max_color_fields]
+        if len(colors) > 0 and len(colors) == self.max_color_fields and all(color.lower() == colors[0].lower() for color in colors):
+            return {0: colors[0]}
 
-        elif len(colors) > 1:
-            for i in range(0, min(len(colors), self.max_color_fields)):
-                self.send_color_command(colors[i], i + 1)
+        return dict((i + 1, color) for i, color in enumerate(colors))
+
+    def send_field_colors(self, field_colors, force=False):
+        """
+        Sends the colors of single fields, skipping fields which already show their color
+        :param field_colors: dict field -> color
+        :param force: send every field regardless of the device state
+        """
+        shown_colors = {} if force else self.shown_colors
+
+        for field in sorted(field_colors.keys()):
+            color = field_colors[field]
+            if not GDevice.is_similar_color(shown_colors.get(field), color, self.color_tolerance):
+                self.send_color_command(color, field)
+
+    def send_frame(self, colors, mode=None, speed=None, brightness=None):
+        """
+        Applies a whole frame in one go, the frame is validated before the first packet is sent
+        :param colors: dict field -> color, field 0 sets the whole device
+        :param mode: str GDevice.MODE_STATIC (default), MODE_BREATHE or MODE_CYCLE
+        :param speed: int speed of breathe and cycle
+        :param brightness: int brightness of breathe and cycle
+        """
+        if mode is None:
+            mode = GDevice.MODE_STATIC
+        self.assert_valid_frame(colors, mode)
+
+        if mode == GDevice.MODE_STATIC:
+            if 0 in colors:
+                self.send_colors_command([colors[0]])
+
+            field_colors = dict((field, color) for field, color in colors.items() if field > 0)
+            if len(field_colors) == self.max_color_fields \
+                    and len(set(color.lower() for color in field_colors.values())) == 1:
+                self.send_colors_command([field_colors[1]])
+            elif len(field_colors) > 0:
+                self.send_field_colors(field_colors)
+
+        elif mode == GDevice.MODE_BREATHE:
+            self.send_breathe_command(colors[min(colors.keys())], speed, brightness)
+
+        elif mode == GDevice.MODE_CYCLE:
+            self.send_cycle_command(speed, brightness)
+
+    def assert_valid_frame(self, colors, mode):
+        if mode == GDevice.MODE_BREATHE:
+            if not self.can_breathe:
+                raise GDeviceException("Device does not support the breathe effect")
+            if len(colors) == 0:
+                raise GDeviceException("The breathe effect needs a color")
+        elif mode == GDevice.MODE_CYCLE:
+            if not self.can_cycle:
+                raise GDeviceException("Device does not support the cycle effect")
+        elif mode != GDevice.MODE_STATIC:
+            raise GDeviceException("Unknown mode '{}'".format(mode))
+
+        for field, color in colors.items():
+            if field < 0 or field > self.max_color_fields:
+                raise GDeviceException("Field {} is out of range (0..{})".format(field, self.max_color_fields))
+            GDevice.assert_valid_color(color)
+
+    def is_uniform_color_shown(self, color):
+        """Whether the device is known to show the given color on all of its fields"""
+        fields = range(1, self.max_color_fields + 1) if self.max_color_fields > 0 else [0]
+        return all(GDevice.is_similar_color(self.shown_colors.get(field), color, self.color_tolerance)
+                   for field in fields)
 
     def send_color_command(self, color, field=0):
         GDevice.assert_valid_color(color)
         self._log("Set color '{}' at slot {}".format(color, field))
-        self.send_data(self.cmd_color.format(
-                            field=self.field_spec.format_num(field),
-                            color=self.color_spec.format_color_hex(color)))
+        self.send_data(self.get_command("color").build(
+                            field=self.field_spec.clamp(field),
+                            color=self.color_spec.clamp_color_hex(color)),
+                       GDevice.MODE_STATIC)
+
+        self.shown_effect = None
+        if field == 0:
+            self.shown_colors = dict((i, color) for i in range(0, self.max_color_fields + 1))
+        else:
+            self.shown_colors.pop(0, None)
+            self.shown_colors[field] = color
 
+        was_static = self.device_state.static
         self.device_state.reset()
         self.device_state.static = True
         self.device_state.colors_uniform = (field == 0)
-        self.device_state.set_color_at(color, field)
+        if field == 0:
+            # field 0 sets the color of every field
+            for i in range(0, self.max_color_fields + 1):
+                self.device_state.set_color_at(color, i)
+        else:
+            if not was_static:
+                # the other fields still show whatever the last effect left
+                self.device_state.reset_colors()
+            self.device_state.set_color_at(color, field)
 
     def send_breathe_command(self, color, speed, brightness=None):
         if not self.can_breathe:
@@ -667,10 +1672,18 @@ class GDevice(object):
             brightness = self.bright_spec.max_value
         GDevice.assert_valid_color(color)
 
-        self.send_data(self.cmd_breathe.format(
-                            color=self.color_spec.format_color_hex(color),
-                            speed=self.speed_spec.format_num(speed),
-                            bright=self.bright_spec.format_num(brightness)))
+        if self.is_effect_shown(GDevice.MODE_BREATHE, speed, brightness, color):
+            self._log("Breathe effect unchanged")
+            return
+
+        self.send_data(self.get_command("breathe").build(
+                            color=self.color_spec.clamp_color_hex(color),
+                            speed=self.speed_spec.clamp(speed),
+                            bright=self.bright_spec.clamp(brightness)),
+                       GDevice.MODE_BREATHE)
+
+        self.shown_colors = {}
+        self.shown_effect = (GDevice.MODE_BREATHE, speed, brightness, color.lower())
 
         self.device_state.reset()
         self.device_state.breathing = True
@@ -685,15 +1698,40 @@ class GDevice(object):
         if brightness is None:
             brightness = self.bright_spec.max_value
 
-        self.send_data(self.cmd_cycle.format(
-                                speed=self.speed_spec.format_num(speed),
-                                bright=self.bright_spec.format_num(brightness)))
+        if self.is_effect_shown(GDevice.MODE_CYCLE, speed, brightness):
+            self._log("Cycle effect unchanged")
+            return
+
+        self.send_data(self.get_command("cycle").build(
+                                speed=self.speed_spec.clamp(speed),
+                                bright=self.bright_spec.clamp(brightness)),
+                       GDevice.MODE_CYCLE)
+
+        self.shown_colors = {}
+        self.shown_effect = (GDevice.MODE_CYCLE, speed, brightness, None)
 
         self.device_state.reset()
         self.device_state.cycling = True
         self.device_state.speed = speed
         self.device_state.brightness = brightness
 
+    def send_brightness_command(self, brightness):
+        """
+        Changes the brightness of the running breathe or cycle effect. Only the effect command is sent, the device is
+        prepared for its mode already.
+        """
+        state = self.device_state
+        if state.breathing and state.colors:
+            self.send_breathe_command(state.colors[0], state.speed, brightness)
+        elif state.cycling:
+            self.send_cycle_command(state.speed, brightness)
+        else:
+            raise GDeviceException("Only the breathe and the cycle effect have a brightness")
+
+    def is_effect_shown(self, mode, speed, brightness, color=None):
+        """Whether the device is known to run the effect with exactly these settings"""
+        return self.shown_effect == (mode, speed, brightness, color.lower() if color is not None else None)
+
     def _log(self, msg):
         if self.verbose:
             print(msg)
@@ -703,6 +1741,24 @@ class GDevice(object):
         if not GDevice.is_valid_color(color):
             raise ValueError("Color '{}' is not a valid color string in hex representation (e.g. 'F0D3AA')".format(color))
 
+    @staticmethod
+    def is_similar_color(color_a, color_b, tolerance=0):
+        """
+        :param tolerance: max. difference per channel (0-255) for colors to be considered equal
+        :return: bool
+        """
+        if color_a is None or color_b is None:
+            return False
+        if tolerance <= 0:
+            return color_a.lower() == color_b.lower()
+
+        rgb_a = int(color_a, 16)
+        rgb_b = int(color_b, 16)
+        for shift in (16, 8, 0):
+            if abs(((rgb_a >> shift) & 0xff) - ((rgb_b >> shift) & 0xff)) > tolerance:
+                return False
+        return True
+
     @staticmethod
     def is_valid_color(data):
         """"""
@@ -849,6 +1905,12 @@ class GlightCommon(object):
     def set_state(self, state_json):
         pass
 
+    def get_device_state(self, device):
+        pass
+
+    def set_device_state(self, device, state):
+        pass
+
     def list_devices(self):
         pass
 
@@ -864,6 +1926,12 @@ class GlightCommon(object):
     def set_cycle(self, device, speed, brightness = None):
         pass
 
+    def set_frame(self, device, colors, mode = None, speed = None, brightness = None):
+        pass
+
+    def set_brightness(self, device, brightness):
+        pass
+
     def quit(self):
         pass
 
@@ -872,7 +1940,12 @@ class GlightRemoteCommon(object):
 
     ARRAY_DELIM = ","
 
+    # The session bus needs no policy, e.g. for running a service with fake devices in tests and benchmarks
+    use_session_bus = False
+
     def get_bus(self):
+        if self.use_session_bus:
+            return SessionBus()
         return SystemBus()
 
 
@@ -888,6 +1961,7 @@ class GlightController(GlightCommon):
         self.backend_type = backend_type
         self.client = None  # type: GlightClient
         self.device_registry = None  # type: GDeviceRegistry
+        self.open_device_names = []  # names of the local devices connected by open_devices()
         self.init_backend()
 
     def init_backend(self):
@@ -990,15 +2064,72 @@ class GlightController(GlightCommon):
 
         return states
 
+    def get_device_state(self, device_name):
+        """
+        :return: GDeviceState
+        """
+        self._assert_supported_backend()
+        if self.is_con_local:
+            device = self.get_device(device_name) # type: GDevice
+            self._assert_device_is_found(device_name, device)
+            return GDeviceState().import_dict(device.device_state.as_dict())
+        elif self.is_con_dbus:
+            return GDeviceState().import_dict(self.client.get_device_state(device_name))
+
+    def set_device_state(self, device_name, state):
+        """
+        Changes the state of a single device, only the given attributes are changed
+        :param state: GDeviceState or dict
+        """
+        self._assert_supported_backend()
+        if isinstance(state, GDeviceState):
+            state = state.as_dict()
+        elif not isinstance(state, dict):
+            raise GControllerException("The method set_device_state only supports a state or a dict")
+
+        if self.is_con_local:
+            device = self.get_device(device_name) # type: GDevice
+            self._assert_device_is_found(device_name, device)
+            if device.apply_state(state):
+                device.restore_state()
+        elif self.is_con_dbus:
+            self.client.set_device_state(device_name, state)
+
+    def watch_state(self, listener=None):
+        """
+        Mirrors the device states of the service, see get_cached_state(). With the local backend there are no other
+        clients, so there is nothing to watch.
+        :param listener: callable(device_name, delta) called on changes
+        """
+        self._assert_supported_backend()
+        if self.is_con_dbus:
+            self.client.watch_state(listener)
+
+    def get_cached_state(self):
+        """
+        Same as get_state(), but answered from the mirror of watch_state() without a call to the service
+        :return: GDeviceState[]
+        """
+        self._assert_supported_backend()
+        if self.is_con_dbus and self.client.get_cached_state() is not None:
+            states = {}
+            for device_name_short, state_data in self.client.get_cached_state().items():
+                states[device_name_short] = GDeviceState().import_dict(state_data)
+            return states
+        return self.get_state()
+
     def set_state(self, state):
         self._assert_supported_backend()
         if self.is_con_local:
             if isinstance(state, dict):
-                self.device_registry.set_state_of_devices(state)
+                changed_devices = self.device_registry.set_state_of_devices(state)
             elif isinstance(state, str):
-                self.device_registry.load_state_from_json(state)
+                changed_devices = self.device_registry.load_state_from_json(state)
             else:
                 raise GControllerException("The method set_state only supports list of states or a JSON representation")
+            # like the service, devices already showing their state are not touched
+            if len(changed_devices) > 0:
+                self.device_registry.restore_states_of_devices(devices=changed_devices)
         elif self.is_con_dbus:
             if isinstance(state, dict):
                 states_dict = {}
@@ -1014,58 +2145,91 @@ class GlightController(GlightCommon):
                 raise GControllerException("The method set_state only supports list of states or a JSON representation")
             self.client.set_state(state_json)
 
-    def set_cycle(self, device_name, speed, brightness=None):
+    def open_devices(self):
+        """
+        Keeps the local devices connected until close_devices(), e.g. while an effect sends a frame per tick. Otherwise
+        every command opens and closes the usb device.
+        """
         self._assert_supported_backend()
         if self.is_con_local:
-            device = self.get_device(device_name) # type: GDevice
-            self._assert_device_is_found(device_name, device)
+            for device in self.device_registry.find_devices():
+                if not device.is_connected:
+                    device.connect()
+                    self.open_device_names.append(device.device_name_short)
+
+    def close_devices(self):
+        """Disconnects the devices connected by open_devices()"""
+        if self.is_con_local:
+            device_names, self.open_device_names = self.open_device_names, []
+            for device_name in device_names:
+                device = self.device_registry.get_known_device(device_name)
+                try:
+                    device.disconnect()
+                except Exception as ex:
+                    print("Could not disconnect device '{}': {}".format(device_name, ex))
+
+    def run_on_local_device(self, device_name, command):
+        """
+        Runs command(device), a device not held open by open_devices() is connected for the command only
+        :param command: callable taking a GDevice
+        """
+        device = self.get_device(device_name) # type: GDevice
+        self._assert_device_is_found(device_name, device)
+        keep_connection = device.is_connected
+        if not keep_connection:
             device.connect()
-            try:
-                device.send_cycle_command(speed, brightness)
-            finally:
+        try:
+            return command(device)
+        finally:
+            if not keep_connection:
                 device.disconnect()
+
+    def set_cycle(self, device_name, speed, brightness=None):
+        self._assert_supported_backend()
+        if self.is_con_local:
+            self.run_on_local_device(device_name, lambda device: device.send_cycle_command(speed, brightness))
         elif self.is_con_dbus:
             self.client.set_cycle(device_name, speed, brightness)
 
+    def set_brightness(self, device_name, brightness):
+        self._assert_supported_backend()
+        if self.is_con_local:
+            self.run_on_local_device(device_name, lambda device: device.send_brightness_command(brightness))
+        elif self.is_con_dbus:
+            self.client.set_brightness(device_name, brightness)
+
     def set_color_at(self, device_name, color, field=0):
         self._assert_supported_backend()
         if self.is_con_local:
-            device = self.get_device(device_name) # type: GDevice
-            self._assert_device_is_found(device_name, device)
-            device.connect()
-            try:
-                device.send_color_command(color, field)
-            finally:
-                device.disconnect()
+            self.run_on_local_device(device_name, lambda device: device.send_color_command(color, field))
         elif self.is_con_dbus:
             self.client.set_color_at(device_name, color, field)
 
     def set_breathe(self, device_name, color, speed=None, brightness=None):
         self._assert_supported_backend()
         if self.is_con_local:
-            device = self.get_device(device_name) # type: GDevice
-            self._assert_device_is_found(device_name, device)
-            device.connect()
-            try:
-                device.send_breathe_command(color, speed, brightness)
-            finally:
-                device.disconnect()
+            self.run_on_local_device(device_name, lambda device: device.send_breathe_command(color, speed, brightness))
         elif self.is_con_dbus:
             self.client.set_breathe(device_name, color, speed, brightness)
 
     def set_colors(self, device_name, colors):
         self._assert_supported_backend()
         if self.is_con_local:
-            device = self.get_device(device_name) # type: GDevice
-            self._assert_device_is_found(device_name, device)
-            device.connect()
-            try:
-                device.send_colors_command(colors)
-            finally:
-                device.disconnect()
+            self.run_on_local_device(device_name, lambda device: device.send_colors_command(colors))
         elif self.is_con_dbus:
             self.client.set_colors(device_name, colors)
 
+    def set_frame(self, device_name, colors, mode=None, speed=None, brightness=None):
+        """
+        :param colors: dict field -> color, field 0 sets the whole device
+        :param mode: str static|breathe|cycle
+        """
+        self._assert_supported_backend()
+        if self.is_con_local:
+            self.run_on_local_device(device_name, lambda device: device.send_frame(colors, mode, speed, brightness))
+        elif self.is_con_dbus:
+            self.client.set_frame(device_name, colors, mode, speed, brightness)
+
     def quit(self):
         self._assert_supported_backend()
         if self.is_con_local:
@@ -1074,6 +2238,445 @@ class GlightController(GlightCommon):
             self.client.quit()
 
 
+class GDeviceSession(object):
+    """An open connection to a device held by the GDeviceSessionPool"""
+
+    def __init__(self, device):
+        """
+        :param device: GDevice
+        """
+        self.device = device
+        self.opened_at = monotonic()
+        self.last_used = self.opened_at
+
+    def touch(self):
+        self.last_used = monotonic()
+
+    def idle_time(self):
+        return monotonic() - self.last_used
+
+
+class GDeviceSessionPool(object):
+    """
+    Keeps devices connected between calls and releases them when they are idle.
+    The pool itself is thread safe, the caller has to hold the lock of a device while using its session.
+    """
+
+    DEFAULT_IDLE_TIMEOUT = 30  # seconds
+
+    def __init__(self, device_registry, idle_timeout=None, verbose=False):
+        """
+        :param device_registry: GDeviceRegistry
+        :param idle_timeout: seconds after which an unused device is released
+        """
+        self.verbose = verbose
+        self.device_registry = device_registry
+        self.idle_timeout = idle_timeout if idle_timeout is not None else self.DEFAULT_IDLE_TIMEOUT
+        self.sessions = {}  # device_name_short -> GDeviceSession
+        self.lock = Lock()  # guards sessions
+
+    def acquire(self, device_name):
+        """
+        Returns the connected device, reusing an open session if it is still healthy
+        :param device_name: str
+        :return: GDevice
+        """
+        with self.lock:
+            session = self.sessions.get(device_name)  # type: GDeviceSession
+
+        if session is not None:
+            if session.device.is_alive():
+                session.touch()
+                return session.device
+            self._log("Session of device '{}' is not healthy anymore, reconnecting".format(device_name))
+            # a replugged device does not show our colors anymore
+            session.device.forget_shown_state()
+            self.close_session(device_name)
+
+        device = self.device_registry.get_device(short_name_filter=device_name)  # type: GDevice
+        if device is None:
+            return None
+
+        try:
+            device.connect()
+        except:
+            # the cached enumeration might be outdated
+            self.device_registry.invalidate()
+            raise
+
+        with self.lock:
+            self.sessions[device_name] = GDeviceSession(device)
+        self._log("Opened session of device '{}'".format(device_name))
+        return device
+
+    def release(self, device, invalidate=False):
+        """
+        Hands a device back to the pool, an invalidated session is closed so the next call reconnects
+        :param device: GDevice
+        """
+        if device is None:
+            return
+
+        device_name = device.device_name_short
+        if invalidate:
+            device.forget_shown_state()
+            self.close_session(device_name)
+        else:
+            with self.lock:
+                session = self.sessions.get(device_name)  # type: GDeviceSession
+            if session is not None:
+                session.touch()
+
+    def get_idle_device_names(self):
+        """
+        :return: str[] names of the devices which have not been used for idle_timeout seconds
+        """
+        with self.lock:
+            return [device_name for device_name, session in self.sessions.items()
+                    if session.idle_time() >= self.idle_timeout]
+
+    def release_idle(self, device_name=None):
+        """Closes the session of the given device or all sessions which have not been used for idle_timeout seconds"""
+        if device_name is None:
+            device_names = self.get_idle_device_names()
+        else:
+            device_names = [device_name]
+
+        for device_name in device_names:
+            with self.lock:
+                session = self.sessions.get(device_name)  # type: GDeviceSession
+            if session is not None and session.idle_time() >= self.idle_timeout:
+                self._log("Releasing idle device '{}'".format(device_name))
+                self.close_session(device_name)
+
+    def close_session(self, device_name):
+        with self.lock:
+            session = self.sessions.pop(device_name, None)  # type: GDeviceSession
+        if session is not None:
+            try:
+                session.device.disconnect()
+            except Exception as ex:
+                self._log("Exception while closing session of device '{}': {}".format(device_name, ex))
+
+    def close_all(self):
+        with self.lock:
+            device_names = list(self.sessions.keys())
+        for device_name in device_names:
+            self.close_session(device_name)
+
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
+
+
+class GReadWriteLock(object):
+    """A lock held either by any number of readers or by a single writer. Waiting writers hold off new readers."""
+
+    def __init__(self):
+        """"""
+        self.condition = Condition(Lock())
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    def acquire_read(self, blocking=True):
+        """
+        :param blocking: if False, return False instead of waiting for a writer
+        :return: bool whether the lock was acquired
+        """
+        with self.condition:
+            while self.writer or self.writers_waiting > 0:
+                if not blocking:
+                    return False
+                self.condition.wait()
+            self.readers = self.readers + 1
+            return True
+
+    def release_read(self):
+        with self.condition:
+            self.readers = self.readers - 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.writers_waiting = self.writers_waiting + 1
+            while self.writer or self.readers > 0:
+                self.condition.wait()
+            self.writers_waiting = self.writers_waiting - 1
+            self.writer = True
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class GDeviceCommand(object):
+    """A command queued for a device"""
+
+    def __init__(self, action, coalesce_key=None, frame=None):
+        """
+        :param action: callable without arguments
+        :param coalesce_key: a pending command with the same key is superseded by this command
+        :param frame: dict field -> color of a static frame, newer frames are merged into it while pending
+        """
+        self.action = action
+        self.coalesce_key = coalesce_key
+        self.frame = frame
+        self.future = Future()
+
+
+class GDeviceWorker(object):
+    """
+    Executes the commands for one device on its own thread, so different devices are served concurrently.
+    A command superseding a pending one (same coalesce key) replaces it, the superseded command is never executed.
+    """
+
+    def __init__(self, device_name, verbose=False):
+        """"""
+        self.verbose = verbose
+        self.device_name = device_name
+        self.pending = deque()  # GDeviceCommand[]
+        self.condition = Condition(Lock())
+        self.running = False
+        self.thread = None  # type: Thread
+
+        self.executed = 0
+        self.superseded = 0
+        self.merged_frames = 0
+        self.dropped_fields = 0
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, name="glight-worker-{}".format(self.device_name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops the worker after the pending commands are done"""
+        if self.thread is not None:
+            with self.condition:
+                self.running = False
+                self.condition.notify()
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, action, coalesce_key=None):
+        """
+        :param action: callable without arguments
+        :param coalesce_key: a pending command with the same key is dropped in favour of this one
+        :return: Future with the result of the action, None if the command was superseded
+        """
+        command = GDeviceCommand(action, coalesce_key)
+        superseded = []
+        with self.condition:
+            if coalesce_key is not None:
+                superseded = [pending for pending in self.pending if pending.coalesce_key == coalesce_key]
+                for pending in superseded:
+                    self.pending.remove(pending)
+                self.superseded = self.superseded + len(superseded)
+            self.pending.append(command)
+            self.condition.notify()
+
+        for pending in superseded:
+            if pending.future.set_running_or_notify_cancel():
+                pending.future.set_result(None)
+
+        return command.future
+
+    def submit_frame(self, frame, action):
+        """
+        Queues a static frame. While the last pending command is a static frame as well the new frame is merged into
+        it, so the device only gets the newest color of every field however fast frames arrive.
+        :param frame: dict field -> color, field 0 sets every field
+        :param action: callable taking the frame to send
+        :return: Future, shared by all frames merged into the same command
+        """
+        with self.condition:
+            last = self.pending[-1] if len(self.pending) > 0 else None
+            if last is not None and last.frame is not None:
+                self.dropped_fields = self.dropped_fields + GDeviceWorker.merge_frame(last.frame, frame)
+                self.merged_frames = self.merged_frames + 1
+                return last.future
+
+            command = GDeviceCommand(None, frame=dict(frame))
+            command.action = lambda: action(command.frame)
+            self.pending.append(command)
+            self.condition.notify()
+            return command.future
+
+    @staticmethod
+    def merge_frame(frame, newer):
+        """
+        Merges newer into frame, the last writer of a field wins
+        :return: int number of field colors that will never be sent
+        """
+        if 0 in newer:
+            dropped = len(frame)
+            frame.clear()
+        else:
+            dropped = sum(1 for field in newer if field in frame)
+        frame.update(newer)
+        return dropped
+
+    def get_pending_count(self):
+        with self.condition:
+            return len(self.pending)
+
+    def get_stats(self):
+        """
+        :return: dict with the counters of the worker
+        """
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "executed": self.executed,
+                "superseded": self.superseded,
+                "merged_frames": self.merged_frames,
+                "dropped_fields": self.dropped_fields
+            }
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.pending) == 0:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    break
+                command = self.pending.popleft()
+
+            if not command.future.set_running_or_notify_cancel():
+                continue
+            try:
+                command.future.set_result(command.action())
+            except BaseException as ex:
+                command.future.set_exception(ex)
+            self.executed = self.executed + 1
+
+
+class GEffectClient(object):
+    """Hands the frames of an effect running in the service straight to the device workers"""
+
+    def __init__(self, service):
+        """
+        :param service: GlightService
+        """
+        self.service = service
+
+    def set_frame(self, device_name, colors, mode=None, speed=None, brightness=None):
+        self.service.run_frame_on_device(device_name, colors)
+
+
+class GEffectRunner(object):
+    """Runs an effect engine of glight_fx on its own thread"""
+
+    def __init__(self, device_name, effect_name, engine, saved_state=None, verbose=False):
+        """
+        :param engine: glight_fx.EffectEngine
+        :param saved_state: dict GDeviceState of the device before the effect started
+        """
+        self.verbose = verbose
+        self.device_name = device_name
+        self.effect_name = effect_name
+        self.engine = engine
+        self.saved_state = saved_state
+        self.thread = None  # type: Thread
+
+    def start(self):
+        self.thread = Thread(target=self.run, name="glight-effect-{}".format(self.device_name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.engine.stop()
+        if self.thread is not None and self.thread is not current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        try:
+            self.engine.run()
+        except Exception as ex:
+            print("Effect '{}' on device '{}' failed: {}".format(self.effect_name, self.device_name, ex))
+            if self.verbose:
+                print(traceback.format_exc())
+
+
+class GDeferredObjectWrapper(ObjectWrapper):
+    """
+    Dispatches D-Bus calls like pydbus does, but a method returning a Future is answered once the future is done. So
+    the main loop keeps serving other calls while a device is busy, without dispatching them nested in the waiting call.
+    """
+
+    def call_method(self, connection, sender, object_path, interface_name, method_name, parameters, invocation):
+        outargs = self.outargs.get(interface_name + "." + method_name)
+        method = getattr(self.object, method_name, None)
+        if outargs is None or method is None:
+            # e.g. org.freedesktop.DBus.Properties
+            return super(GDeferredObjectWrapper, self).call_method(
+                connection, sender, object_path, interface_name, method_name, parameters, invocation)
+
+        try:
+            result = method(*parameters)
+        except Exception as ex:
+            GDeferredObjectWrapper.return_error(invocation, ex)
+            return
+
+        if isinstance(result, Future):
+            # done callbacks run on the worker threads, the reply is sent from the main loop
+            result.add_done_callback(lambda future: GLib.idle_add(
+                GDeferredObjectWrapper.return_future, invocation, outargs, future))
+        else:
+            GDeferredObjectWrapper.return_result(invocation, outargs, result)
+
+    @staticmethod
+    def return_future(invocation, outargs, future):
+        try:
+            result = future.result()
+        except Exception as ex:
+            GDeferredObjectWrapper.return_error(invocation, ex)
+        else:
+            GDeferredObjectWrapper.return_result(invocation, outargs, result)
+        return False  # run once
+
+    @staticmethod
+    def return_result(invocation, outargs, result):
+        if len(outargs) == 0:
+            invocation.return_value(None)
+        elif len(outargs) == 1:
+            invocation.return_value(GLib.Variant("(" + "".join(outargs) + ")", (result,)))
+        else:
+            invocation.return_value(GLib.Variant("(" + "".join(outargs) + ")", result))
+
+    @staticmethod
+    def return_error(invocation, ex):
+        """Errors are named after the exception like pydbus does, e.g. unknown.GDeviceException"""
+        error_name = type(ex).__name__
+        if "." not in error_name:
+            error_name = "unknown." + error_name
+        invocation.return_dbus_error(error_name, str(ex))
+
+
 class GlightService(GlightRemoteCommon):
     """
       <node>
@@ -1088,9 +2691,20 @@ class GlightService(GlightRemoteCommon):
           <method name='get_state'>
             <arg type='s' name='resp'  direction='out'/>
           </method>
+          <method name='get_stats'>
+            <arg type='s' name='resp'  direction='out'/>
+          </method>
           <method name='set_state'>
             <arg type='s' name='state'  direction='in'/>
           </method>
+          <method name='get_device_state'>
+            <arg type='s' name='device' direction='in'/>
+            <arg type='s' name='resp'   direction='out'/>
+          </method>
+          <method name='set_device_state'>
+            <arg type='s' name='device' direction='in'/>
+            <arg type='s' name='state'  direction='in'/>
+          </method>
           <method name='set_color_at'>
             <arg type='s' name='device' direction='in'/>
             <arg type='s' name='color'  direction='in'/>
@@ -1100,6 +2714,10 @@ class GlightService(GlightRemoteCommon):
             <arg type='s'  name='device' direction='in'/>
             <arg type='as' name='colors' direction='in'/>
           </method>
+          <method name='set_colors_nowait'>
+            <arg type='s'  name='device' direction='in'/>
+            <arg type='as' name='colors' direction='in'/>
+          </method>
           <method name='set_breathe'>
             <arg type='s' name='device' direction='in'/>
             <arg type='s' name='color'  direction='in'/>
@@ -1111,10 +2729,49 @@ class GlightService(GlightRemoteCommon):
             <arg type='x' name='speed'  direction='in'/>
             <arg type='x' name='brightness' direction='in'/>
           </method>
+          <method name='set_brightness'>
+            <arg type='s' name='device' direction='in'/>
+            <arg type='x' name='brightness' direction='in'/>
+          </method>
+          <method name='set_frame'>
+            <arg type='s'    name='device' direction='in'/>
+            <arg type='a{qs}' name='colors' direction='in'/>
+            <arg type='s'    name='mode'   direction='in'/>
+            <arg type='x'    name='speed'  direction='in'/>
+            <arg type='x'    name='brightness' direction='in'/>
+          </method>
+          <method name='set_frame_nowait'>
+            <arg type='s'    name='device' direction='in'/>
+            <arg type='a{qs}' name='colors' direction='in'/>
+            <arg type='s'    name='mode'   direction='in'/>
+            <arg type='x'    name='speed'  direction='in'/>
+            <arg type='x'    name='brightness' direction='in'/>
+          </method>
+          <method name='list_effects'>
+            <arg type='as' name='resp' direction='out'/>
+          </method>
+          <method name='start_effect'>
+            <arg type='s' name='device' direction='in'/>
+            <arg type='s' name='name'   direction='in'/>
+            <arg type='s' name='params' direction='in'/>
+          </method>
+          <method name='stop_effect'>
+            <arg type='s' name='device' direction='in'/>
+          </method>
           <method name='echo'>
             <arg type='x' name='s' direction='in'/>
           </method>
           <method name='quit'/>
+          <signal name='device_added'>
+            <arg type='s' name='device'/>
+          </signal>
+          <signal name='device_removed'>
+            <arg type='s' name='device'/>
+          </signal>
+          <signal name='state_changed'>
+            <arg type='s' name='device'/>
+            <arg type='s' name='delta'/>
+          </signal>
         </interface>
       </node>
     """
@@ -1125,17 +2782,65 @@ class GlightService(GlightRemoteCommon):
     bus_name = "de.sgdw.linux.glight"
     bus_path = "/" + bus_name.replace(".", "/")
 
-    def __init__(self, state_file=None, verbose=False):
-        """"""
+    # Seconds between checks for idle device sessions
+    idle_check_interval = 5
+
+    # Seconds between rescans of the devices, hotplug events make them mostly unnecessary
+    rescan_interval = 5
+    rescan_interval_hotplug = 60
+
+    device_added = signal()
+    device_removed = signal()
+    state_changed = signal()  # device, json of the changed GDeviceState attributes
+
+    def __init__(self, state_file=None, verbose=False, idle_timeout=None, state_format=None, autosave_delay=None,
+                 backend_type=None):
+        """
+        :param state_format: str GDeviceStateCodec.FORMAT_JSON (default) or FORMAT_BINARY
+        :param autosave_delay: float seconds without further changes after which the state file is saved, None
+                               disables the autosave
+        :param backend_type: str UsbBackend.TYPE_*, defaults to UsbBackend.TYPE_DEFAULT
+        """
         self.state_file = state_file
         self.verbose = verbose
+        self.backend_type = backend_type or UsbBackend.TYPE_DEFAULT
+        self.state_format = state_format or GDeviceStateCodec.FORMAT_JSON
+
+        self.autosave_delay = autosave_delay
+        self.autosave_at = None  # monotonic time the pending autosave is due
+        self.autosave_pending = False
+        self.autosave_lock = Lock()
+        self.save_lock = Lock()  # one writer of the state file, the registry lock is only held for reading
 
         self.loop = None
         self.bus  = None
-        self.lock = Semaphore()
+        self.registration = None  # type: ObjectRegistration
+
+        # Commands of a device hold its lock and the registry lock for reading. Operations on the state of all
+        # devices hold the registry lock for writing.
+        self.registry_lock = GReadWriteLock()
+        self.device_locks = {}  # device_name_short -> Lock
+        self.workers = {}  # device_name_short -> GDeviceWorker
+        self.workers_lock = Lock()  # guards device_locks and workers
+
+        self.effects = {}  # device_name_short -> GEffectRunner
+        self.effects_lock = Lock()
+
+        # restores of all devices, off the main loop and in the order of the calls
+        self.restore_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="glight-restore")
+
+        # get_state() and get_device_state() answer from these snapshots, so the main loop never waits for the
+        # registry lock, e.g. while a restore holds it
+        self.device_states = {}  # device_name_short -> state dict
+        self.device_states_lock = Lock()
+
+        self.emitted_states = {}  # device_name_short -> state dict as last sent with state_changed
+        self.state_emits = {}  # device_name_short -> state dict of a pending state_changed signal
+        self.state_emits_lock = Lock()
 
         self.device_registry = None # type: GDeviceRegistry
-        self.init_backend()
+        self.session_pool = None # type: GDeviceSessionPool
+        self.init_backend(idle_timeout)
 
     def run(self):
         """"""
@@ -1143,33 +2848,342 @@ class GlightService(GlightRemoteCommon):
         self.loop = GLib.MainLoop()
 
         self.bus = self.get_bus()
-        self.bus.publish(self.bus_name, self)
+        self.publish()
 
-        self.loop.run()
+        GLib.timeout_add_seconds(self.idle_check_interval, self.on_idle_check)
+        self.watch_devices()
 
-    def init_backend(self):
-        self.device_registry = GDeviceRegistry()
+        try:
+            self.loop.run()
+        finally:
+            self.restore_executor.shutdown(wait=True)
+            self.stop_effects()
+            self.stop_workers()
+            if self.autosave_delay is not None:
+                self.autosave()
+            with self.registry_lock.writing():
+                self.session_pool.close_all()
+                self.device_registry.disable_hotplug()
+
+    def publish(self):
+        """Publishes the service like bus.publish() does, but with GDeferredObjectWrapper dispatching the calls"""
+        interfaces = Gio.DBusNodeInfo.new_for_xml(type(self).__doc__).interfaces
+        wrapper = GDeferredObjectWrapper(self, interfaces)
+        self.registration = ObjectRegistration(self.bus, self.bus_path, interfaces, wrapper, own_wrapper=True)
+        self.bus.request_name(self.bus_name)
+
+    def init_backend(self, idle_timeout=None):
+        self.device_registry = GDeviceRegistry(backend_type=self.backend_type)
+        self.device_registry.state_format = self.state_format
+        self.session_pool = GDeviceSessionPool(self.device_registry, idle_timeout=idle_timeout, verbose=self.verbose)
+        self.update_device_states(self.device_registry.get_state_of_devices())
 
     def prepare_run(self):
         if self.state_file is not None:
             self.load_state()
 
-    def open_device(self, device_name):
-        self.lock.acquire()
-        device = self.device_registry.get_device(short_name_filter=device_name) # type: GDevice
-        if device is not None:
-            device.connect()
+    def watch_devices(self):
+        """Keeps the device enumeration up to date via hotplug events and a periodic rescan as fallback"""
+        self.device_registry.add_presence_listener(self.on_device_presence)
+
+        rescan_interval = self.rescan_interval
+        try:
+            if self.device_registry.enable_hotplug():
+                # the poll fds of a context without open devices do not change, so they are only watched once
+                for fd, events in self.device_registry.get_hotplug_poll_fds():
+                    GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IOCondition(events), self.on_hotplug_events)
+                rescan_interval = self.rescan_interval_hotplug
+        except Exception as ex:
+            print("Hotplug notifications not available: {}".format(ex))
+            self.device_registry.disable_hotplug()
+
+        self.device_registry.rescan_interval = rescan_interval
+        self.device_registry.rescan()
+        GLib.timeout_add_seconds(rescan_interval, self.on_rescan)
+
+    def on_hotplug_events(self, source, condition):
+        self.device_registry.handle_hotplug_events()
+        return True  # keep watching
+
+    def on_rescan(self):
+        self.device_registry.rescan()
+        return True  # keep the GLib timer running
+
+    def on_device_presence(self, device, present):
+        """
+        :param device: GDevice
+        :param present: bool
+        """
+        # rescans may happen on worker threads, signals are emitted from the main loop
+        GLib.idle_add(self.emit_device_presence, device.device_name_short, present)
+
+    def emit_device_presence(self, device_name, present):
+        if present:
+            print("Device '{}' added".format(device_name))
+            self.device_added(device_name)
+        else:
+            print("Device '{}' removed".format(device_name))
+            self.device_removed(device_name)
+        return False  # run once
+
+    def notify_state_change(self, device_name, state):
+        """
+        Sends the changed attributes of a device state with state_changed. Changes made before the main loop gets to
+        emit the signal are sent together, e.g. the frames of a running effect.
+        :param device_name: str
+        :param state: dict snapshot of the device state, taken while holding the lock of the device or the registry
+        """
+        self.update_device_states({device_name: state})
+        with self.state_emits_lock:
+            pending = device_name in self.state_emits
+            self.state_emits[device_name] = state
+        if not pending:
+            GLib.idle_add(self.emit_state_changed, device_name)
+
+    def emit_state_changed(self, device_name):
+        with self.state_emits_lock:
+            state = self.state_emits.pop(device_name, None)
+
+        if state is not None:
+            delta = GDeviceState.get_delta(state, self.emitted_states.get(device_name))
+            if len(delta) > 0:
+                self.emitted_states.setdefault(device_name, {}).update(delta)
+                self.state_changed(device_name, json.dumps(delta))
+        return False  # run once
+
+    def update_device_states(self, states):
+        """
+        :param states: dict device_name_short -> state dict, snapshots taken while holding the lock of the device or
+                       the registry
+        """
+        with self.device_states_lock:
+            self.device_states.update(states)
+
+    def get_device_states(self):
+        """
+        :return: dict device_name_short -> state dict
+        """
+        with self.device_states_lock:
+            return copy.deepcopy(self.device_states)
+
+    def on_idle_check(self):
+        # runs on the main loop, so the idle sessions are released next time if a restore holds the registry lock
+        if not self.registry_lock.acquire_read(False):
+            return True
+        try:
+            for device_name in self.session_pool.get_idle_device_names():
+                device_lock = self.get_device_lock(device_name)
+                if device_lock.acquire(False):  # a busy device is not idle
+                    try:
+                        self.session_pool.release_idle(device_name)
+                    finally:
+                        device_lock.release()
+        finally:
+            self.registry_lock.release_read()
+        return True  # keep the GLib timer running
+
+    def get_device_lock(self, device_name):
+        with self.workers_lock:
+            if device_name not in self.device_locks:
+                self.device_locks[device_name] = Lock()
+            return self.device_locks[device_name]
+
+    def get_known_device(self, device_name):
+        """
+        :return: GDevice
+        """
+        device = self.device_registry.get_known_device(device_name)
+        if device is None:
+            raise GDeviceException("Device '{}' not found".format(device_name))
         return device
 
-    def close_device(self, device):
+    def get_worker(self, device_name):
+        """
+        :return: GDeviceWorker
+        """
+        self.get_known_device(device_name)
+
+        with self.workers_lock:
+            worker = self.workers.get(device_name)
+            if worker is None:
+                worker = GDeviceWorker(device_name, verbose=self.verbose)
+                worker.start()
+                self.workers[device_name] = worker
+            return worker
+
+    def stop_workers(self):
+        with self.workers_lock:
+            workers = list(self.workers.values())
+            self.workers = {}
+        for worker in workers:
+            worker.stop()
+
+    def open_device(self, device_name):
+        self.registry_lock.acquire_read()
+        device_lock = self.get_device_lock(device_name)
+        device_lock.acquire()
+        try:
+            return self.session_pool.acquire(device_name)
+        except:
+            device_lock.release()
+            self.registry_lock.release_read()
+            raise
+
+    def close_device(self, device_name, device, invalidate=False):
         """
+        :param device_name: str
         :param device: GDevice
+        :param invalidate: close the session, e.g. after an usb error
         :return:
         """
-        if device is not None:
-            device.disconnect()
+        try:
+            self.session_pool.release(device, invalidate=invalidate)
+        finally:
+            self.get_device_lock(device_name).release()
+            self.registry_lock.release_read()
+
+    def run_on_device(self, device_name, command, coalesce_key=None, wait=True):
+        """
+        Queues command(device) on the worker of the device
+        :param device_name: str
+        :param command: callable taking a GDevice
+        :param coalesce_key: a pending command of the device with the same key is superseded by this one
+        :param wait: wait for the result, otherwise failures are only logged
+        """
+        worker = self.get_worker(device_name)
+        future = worker.submit(lambda: self.execute_on_device(device_name, command), coalesce_key)
+        if wait:
+            return self.wait_for(future)
+
+        future.add_done_callback(self.on_command_done)
+        return None
+
+    def run_frame_on_device(self, device_name, frame, wait=True):
+        """
+        Queues a static frame on the worker of the device, merged with a pending frame of the device
+        :param device_name: str
+        :param frame: dict field -> color
+        :param wait: wait until the frame is applied, otherwise failures are only logged
+        """
+        self.get_known_device(device_name).assert_valid_frame(frame, GDevice.MODE_STATIC)
+
+        worker = self.get_worker(device_name)
+        future = worker.submit_frame(frame, lambda merged: self.execute_on_device(
+            device_name, lambda device: device.send_frame(merged)))
+        if wait:
+            return self.wait_for(future)
+
+        future.add_done_callback(self.on_command_done)
+        return None
+
+    def is_on_main_loop(self):
+        return self.loop is not None and self.loop.is_running() and current_thread() is main_thread()
+
+    def wait_for(self, future):
+        """
+        Waits for a queued command. On the main loop the future itself is returned, GDeferredObjectWrapper replies to
+        the D-Bus call once it is done, so e.g. list_devices() and get_state() are answered while a device is busy.
+        :param future: Future
+        :return: the result of the command or on the main loop the Future
+        """
+        if self.is_on_main_loop():
+            return future
+        return future.result()
 
-        self.lock.release()
+    def run_off_main_loop(self, function):
+        """
+        Runs function on the restore executor if called on the main loop, e.g. restores which take the registry lock
+        for writing and so have to wait for the commands of all devices
+        :return: like wait_for()
+        """
+        if not self.is_on_main_loop():
+            return function()
+        return self.restore_executor.submit(function)
+
+    def on_command_done(self, future):
+        """Logs failures of commands nobody waits for"""
+        if not future.cancelled() and future.exception() is not None:
+            ex = future.exception()
+            print("Queued command failed: {}".format(ex))
+            if self.verbose:
+                traceback.print_exception(type(ex), ex, ex.__traceback__)
+
+    def execute_on_device(self, device_name, command):
+        """
+        Runs command(device) on the open session of a device. If the usb connection broke (e.g. the device was
+        unplugged and plugged in again) the session is dropped and the command is retried once on a new connection.
+        :param device_name: str
+        :param command: callable taking a GDevice
+        """
+        retries = 1
+        while True:
+            device = self.open_device(device_name)
+            invalidate = False
+            try:
+                if device is None:
+                    raise GDeviceException("Device '{}' not found".format(device_name))
+                result = command(device)
+                self.schedule_autosave()
+                self.notify_state_change(device_name, device.device_state.as_dict())
+                return result
+            except usb1.USBError as ex:
+                invalidate = True
+                if retries <= 0:
+                    raise
+                retries = retries - 1
+                print("Lost connection to device '{}', reconnecting ({})".format(device_name, ex))
+            finally:
+                self.close_device(device_name, device, invalidate=invalidate)
+
+    def restore_states(self, devices=None):
+        """
+        Restores the device states in parallel, devices with an open session are restored over that session
+        :param devices: GDevice[] to restore, all known devices if None
+        """
+        with self.registry_lock.writing():
+            latencies = self.device_registry.restore_states_of_devices(devices=devices)
+            states = dict((device_name, self.get_known_device(device_name).device_state.as_dict())
+                          for device_name in latencies.keys())
+        for device_name, state in states.items():
+            self.notify_state_change(device_name, state)
+        if self.verbose:
+            print("Restored states in {}".format(", ".join(
+                "{}: {:.1f} ms".format(device_name, latency * 1000)
+                for device_name, latency in sorted(latencies.items()))))
+
+    def schedule_autosave(self):
+        """Saves the state file once no further change happened for autosave_delay seconds"""
+        if self.state_file is None or self.autosave_delay is None:
+            return
+
+        with self.autosave_lock:
+            self.autosave_at = monotonic() + self.autosave_delay
+            if self.autosave_pending:
+                return
+            self.autosave_pending = True
+        GLib.timeout_add(int(self.autosave_delay * 1000), self.on_autosave)
+
+    def on_autosave(self):
+        with self.autosave_lock:
+            remaining = self.autosave_at - monotonic()
+            if remaining > 0:
+                GLib.timeout_add(int(remaining * 1000) + 1, self.on_autosave)
+                return False
+            self.autosave_pending = False
+
+        self.run_off_main_loop(self.autosave)
+        return False
+
+    def autosave(self):
+        """Writes the state file if a device state changed"""
+        try:
+            with self.save_lock, self.registry_lock.reading():
+                if self.device_registry.write_state_of_devices(self.state_file) and self.verbose:
+                    print("Saved state to '{}'".format(self.state_file))
+        except Exception as ex:
+            print("Failed to save state '{}'".format(ex))
+            if self.verbose:
+                print(traceback.format_exc())
 
     def unmarshall_num_par(self, num_val, if_not_set=None):
         """None is not allowed over dbus, so a negative value is the None equivalent over the wire"""
@@ -1180,123 +3194,276 @@ class GlightService(GlightRemoteCommon):
     # Public
     def load_state(self, filename = None):
         if self.state_file is not None:
-            try:
+            return self.run_off_main_loop(self.load_and_restore_states)
+
+    def load_and_restore_states(self):
+        try:
+            with self.registry_lock.writing():
                 self.device_registry.load_state_of_devices(self.state_file)
-                self.device_registry.restore_states_of_devices()
-            except Exception as ex:
-                print("Failed to restore state '{}'".format(ex.message))
-                if self.verbose:
-                    print("Exception: {}".format(ex))
-                    print(traceback.format_exc())
+                self.update_device_states(self.device_registry.get_state_of_devices())
+            self.restore_states()
+        except Exception as ex:
+            print("Failed to restore state '{}'".format(ex))
+            if self.verbose:
+                print("Exception: {}".format(ex))
+                print(traceback.format_exc())
 
     # Public
     def save_state(self, filename = None):
         if self.state_file is not None:
-            try:
-                self.device_registry.write_state_of_devices(self.state_file)
-            except Exception as ex:
-                print("Failed to save state '{}'".format(ex.message))
-                if self.verbose:
-                    print("Exception: {}".format(ex))
-                    print(traceback.format_exc())
-                raise GDeviceException("Failed to save state")
+            return self.run_off_main_loop(self.write_state)
         else:
             raise GDeviceException("No state file configured")
 
+    def write_state(self):
+        try:
+            with self.save_lock, self.registry_lock.reading():
+                self.device_registry.write_state_of_devices(self.state_file, force=True)
+        except Exception as ex:
+            print("Failed to save state '{}'".format(ex))
+            if self.verbose:
+                print("Exception: {}".format(ex))
+                print(traceback.format_exc())
+            raise GDeviceException("Failed to save state")
+
     # Public
     def get_state(self):
-        return self.device_registry.get_state_as_json()
+        return json.dumps(self.get_device_states(), indent=4)
+
+    # Public
+    def get_stats(self):
+        """
+        :return: str json with the command counters per device, e.g. merged_frames and dropped_fields, and the
+                 duration of the last restore in restore_ms
+        """
+        with self.workers_lock:
+            workers = dict(self.workers)
+        stats = dict((device_name, worker.get_stats()) for device_name, worker in workers.items())
+        for device_name, latency in self.device_registry.restore_latencies.items():
+            stats.setdefault(device_name, {})["restore_ms"] = round(latency * 1000, 1)
+        return json.dumps(stats)
 
     # Public
     def set_state(self, state_json):
+        return self.run_off_main_loop(lambda: self.apply_and_restore_states(state_json))
+
+    def apply_and_restore_states(self, state_json):
         try:
             if self.verbose:
                 print("Set state '{}'".format(state_json))
-            self.device_registry.load_state_from_json(state_json)
-            self.device_registry.restore_states_of_devices()
+            with self.registry_lock.writing():
+                changed_devices = self.device_registry.load_state_from_json(state_json)
+                self.update_device_states(self.device_registry.get_state_of_devices())
+            # devices already showing their state are not touched
+            if len(changed_devices) > 0:
+                self.restore_states(changed_devices)
         except Exception as ex:
-            print("Failed to set state '{}'".format(ex.message))
+            print("Failed to set state '{}'".format(ex))
             if self.verbose:
                 print("Exception: {}".format(ex))
                 print(traceback.format_exc())
 
+    # Public
+    def get_device_state(self, device_name):
+        self.get_known_device(device_name)
+        return json.dumps(self.get_device_states().get(device_name))
+
+    # Public
+    def set_device_state(self, device_name, state_json):
+        """
+        Applies the attributes given in state_json to the state of a device and restores it, if it changed
+        :param state_json: str json of a state dict, missing attributes keep their value
+        """
+        if self.verbose:
+            print("set_device_state('{}', '{}')".format(device_name, state_json))
+        self.get_known_device(device_name)
+        state = json.loads(state_json)
+
+        def apply_state(device):
+            if device.apply_state(state):
+                device.restore_state()
+
+        return self.run_on_device(device_name, apply_state)
+
     # Public
     def list_devices(self):
         devices = {}
         for device in self.device_registry.find_devices():
             devices[device.device_name_short] = device.device_name
         print("list_devices() := {}".format(devices))
-        self.lock.release()
         return devices
 
     # Public
     def set_color_at(self, device_name, color, field):
-        device = self.open_device(device_name)
-        try:
-            if device is not None:
-                print("set_color_at('{}', '{}', {})".format(device_name, color, field))
-                device.send_color_command(color, field)
-            else:
-                raise GDeviceException("Device '{}' not found".format(device_name))
-        finally:
-            self.close_device(device)
+        print("set_color_at('{}', '{}', {})".format(device_name, color, field))
+        device = self.get_known_device(device_name)
+        return self.run_frame_on_device(device_name, {device.field_spec.clamp(field): color})
 
     # Public
     def set_colors(self, device_name, colors):
-        device = self.open_device(device_name)
-        try:
-            if device is not None:
-                print("set_colors('{}', {})".format(device_name, colors))
-                device.send_colors_command(colors)
-            else:
-                raise GDeviceException("Device '{}' not found".format(device_name))
-        finally:
-            self.close_device(device)
+        print("set_colors('{}', {})".format(device_name, colors))
+        return self.queue_colors(device_name, colors, wait=True)
+
+    # Public
+    def set_colors_nowait(self, device_name, colors):
+        if self.verbose:
+            print("set_colors_nowait('{}', {})".format(device_name, colors))
+        self.queue_colors(device_name, colors, wait=False)
+
+    def queue_colors(self, device_name, colors, wait):
+        device = self.get_known_device(device_name)
+        return self.run_frame_on_device(device_name, device.get_static_frame(colors), wait=wait)
 
     # Public
     def set_breathe(self, device_name, color, speed, brightness):
-        device = self.open_device(device_name)
-        try:
-            if device is not None:
-                print("set_breathe('{}', '{}', {}, {})".format(device_name, color, speed, brightness))
-                device.send_breathe_command(
-                    color=color,
-                    speed=self.unmarshall_num_par(speed),
-                    brightness=self.unmarshall_num_par(brightness))
-            else:
-                raise GDeviceException("Device '{}' not found".format(device_name))
-        finally:
-            self.close_device(device)
+        print("set_breathe('{}', '{}', {}, {})".format(device_name, color, speed, brightness))
+        return self.run_on_device(device_name, lambda device: device.send_breathe_command(
+            color=color,
+            speed=self.unmarshall_num_par(speed),
+            brightness=self.unmarshall_num_par(brightness)),
+            coalesce_key="breathe")
 
     # Public
     def set_cycle(self, device_name, speed, brightness):
-        device = self.open_device(device_name)
+        print("set_cycle('{}', {}, {})".format(device_name, speed, brightness))
+        return self.run_on_device(device_name, lambda device: device.send_cycle_command(
+            speed=self.unmarshall_num_par(speed),
+            brightness=self.unmarshall_num_par(brightness)),
+            coalesce_key="cycle")
+
+    # Public
+    def set_brightness(self, device_name, brightness):
+        print("set_brightness('{}', {})".format(device_name, brightness))
+        return self.run_on_device(device_name, lambda device: device.send_brightness_command(
+            self.unmarshall_num_par(brightness)),
+            coalesce_key="brightness")
+
+    # Public
+    def set_frame(self, device_name, colors, mode, speed, brightness):
+        print("set_frame('{}', {}, '{}', {}, {})".format(device_name, colors, mode, speed, brightness))
+        return self.queue_frame(device_name, colors, mode, speed, brightness, wait=True)
+
+    # Public
+    def set_frame_nowait(self, device_name, colors, mode, speed, brightness):
+        if self.verbose:
+            print("set_frame_nowait('{}', {}, '{}', {}, {})".format(device_name, colors, mode, speed, brightness))
+        self.queue_frame(device_name, colors, mode, speed, brightness, wait=False)
+
+    def queue_frame(self, device_name, colors, mode, speed, brightness, wait):
+        if (mode or GDevice.MODE_STATIC) == GDevice.MODE_STATIC:
+            return self.run_frame_on_device(device_name, colors, wait=wait)
+
+        return self.run_on_device(device_name, lambda device: device.send_frame(
+            colors=colors,
+            mode=mode or None,
+            speed=self.unmarshall_num_par(speed),
+            brightness=self.unmarshall_num_par(brightness)),
+            coalesce_key=("frame", mode), wait=wait)
+
+    @staticmethod
+    def import_glight_fx():
+        """
+        Imports glight_fx once an effect is used. Run as script this module is __main__, it is registered as glight
+        too, otherwise the "import glight" of glight_fx would load a second copy with registries and classes of its own.
+        :return: module glight_fx
+        """
+        if __name__ == "__main__":
+            sys.modules.setdefault("glight", sys.modules[__name__])
+        try:
+            import glight_fx
+        except ImportError as ex:
+            raise GDeviceException("Effects are not available: {}".format(ex))
+        return glight_fx
+
+    def get_effect_registry(self):
+        """
+        :return: glight_fx.EffectRegistry
+        """
+        return self.import_glight_fx().EffectRegistry.get_default(verbose=self.verbose)
+
+    # Public
+    def list_effects(self):
+        return self.get_effect_registry().get_names()
+
+    # Public
+    def start_effect(self, device_name, effect_name, params_json):
+        """
+        Renders an effect of glight_fx within the service, replacing the effect running on the device
+        :param params_json: str json object with the parameters of the effect, "fps" sets the frame rate
+        """
+        print("start_effect('{}', '{}', '{}')".format(device_name, effect_name, params_json))
+        device = self.get_known_device(device_name)
+
+        params = json.loads(params_json) if params_json else {}
+        glight_fx = self.import_glight_fx()
+        effect = self.get_effect_registry().create(effect_name, devices=[device_name], params=params)
+        engine = glight_fx.EffectEngine(GEffectClient(self), fps=params.get("fps"), verbose=self.verbose)
+        engine.add_layer(glight_fx.Layer(effect))
+
+        # failures are reported to the caller, not only on the thread of the effect
         try:
-            if device is not None:
-                print("set_cycle('{}', {}, {})".format(device_name, speed, brightness))
-                device.send_cycle_command(
-                    speed=self.unmarshall_num_par(speed),
-                    brightness=self.unmarshall_num_par(brightness))
+            engine.setup()
+            device.assert_valid_frame(engine.render(0.0).get(device_name, {}), GDevice.MODE_STATIC)
+        except Exception as ex:
+            engine.teardown()
+            raise GDeviceException("Effect '{}' failed on device '{}': {}".format(effect_name, device_name, ex))
+
+        with self.effects_lock:
+            previous = self.effects.get(device_name)
+            if previous is not None:
+                saved_state = previous.saved_state
             else:
-                raise GDeviceException("Device '{}' not found".format(device_name))
-        finally:
-            self.close_device(device)
+                saved_state = copy.deepcopy(self.get_known_device(device_name).device_state.as_dict())
+            runner = GEffectRunner(device_name, effect_name, engine, saved_state=saved_state, verbose=self.verbose)
+            self.effects[device_name] = runner
+        if previous is not None:
+            previous.stop()
+        runner.start()
+
+    # Public
+    def stop_effect(self, device_name):
+        """Stops the effect running on the device and restores the state the device had before"""
+        print("stop_effect('{}')".format(device_name))
+        with self.effects_lock:
+            runner = self.effects.pop(device_name, None)
+        if runner is not None:
+            return self.stop_effect_runner(runner)
+
+    def stop_effects(self):
+        with self.effects_lock:
+            runners = list(self.effects.values())
+            self.effects = {}
+        for runner in runners:
+            self.stop_effect_runner(runner)
+
+    def stop_effect_runner(self, runner):
+        """
+        :return: like run_on_device() the restore of the state the device had before the effect
+        """
+        runner.stop()
+        if runner.saved_state is None:
+            return None
+
+        def restore(device):
+            device.device_state.import_dict(runner.saved_state)
+            device.restore_state()
+
+        try:
+            return self.run_on_device(runner.device_name, restore)
+        except Exception as ex:
+            print("Could not restore state of device '{}' after the effect: {}".format(runner.device_name, ex))
 
     # Public
     def echo(self, s):
         """returns whatever is passed to it"""
-        self.lock.acquire()
         print("echo('{}')".format(s))
-        self.lock.release()
         return s
 
     # Public
     def quit(self):
         """removes this object from the DBUS connection and exits"""
-        self.lock.acquire()
         if self.loop is not None:
             self.loop.quit()
-        self.lock.release()
 
 
 class GlightClient(GlightRemoteCommon):
@@ -1308,6 +3475,9 @@ class GlightClient(GlightRemoteCommon):
         self.bus  = None
         self.proxy = None # type: GlightRemoteCommon
 
+        self.states = None  # device_name_short -> state dict, kept up to date by state_changed signals
+        self.state_listeners = []
+
     def connect(self):
         self.bus = self.get_bus()
         self.proxy = self.bus.get(GlightService.bus_name)
@@ -1336,9 +3506,51 @@ class GlightClient(GlightRemoteCommon):
     def get_state(self):
         return self.proxy.get_state()
 
+    def get_stats(self):
+        return json.loads(self.proxy.get_stats())
+
+    def watch_state(self, listener=None):
+        """
+        Keeps a local mirror of the device states, which is updated by the state_changed signals of the service.
+        Signals are only received while a GLib main loop runs.
+        :param listener: callable(device_name, delta) called after the mirror was updated
+        """
+        if listener is not None:
+            self.state_listeners.append(listener)
+        if self.states is None:
+            # subscribe first so no change gets lost, deltas already in the snapshot are applied twice
+            self.proxy.state_changed.connect(self.on_state_changed)
+            self.states = json.loads(self.proxy.get_state())
+
+    def on_state_changed(self, device_name, delta_json):
+        delta = json.loads(delta_json)
+        self._log("State of device '{}' changed: {}".format(device_name, delta))
+        self.states.setdefault(device_name, {}).update(delta)
+        for listener in self.state_listeners:
+            listener(device_name, delta)
+
+    def get_cached_state(self):
+        """
+        :return: dict device_name_short -> state dict, None if watch_state() was not called
+        """
+        return self.states
+
     def set_state(self, state_json):
         return self.proxy.set_state(state_json)
 
+    def get_device_state(self, device):
+        """
+        :return: dict
+        """
+        return json.loads(self.proxy.get_device_state(device))
+
+    def set_device_state(self, device, state):
+        """
+        :param state: dict attributes to change, the others keep their value
+        """
+        self._log("Setting state of device '{}' to {}".format(device, state))
+        self.proxy.set_device_state(device, json.dumps(state))
+
     def list_devices(self):
         return self.proxy.list_devices()
 
@@ -1350,6 +3562,11 @@ class GlightClient(GlightRemoteCommon):
         self._log("Setting colors at device '{}' to {}".format(device, colors))
         self.proxy.set_colors(device, colors)
 
+    def set_colors_nowait(self, device, colors):
+        """Returns as soon as the service has queued the colors"""
+        self._log("Queueing colors at device '{}' to {}".format(device, colors))
+        self.proxy.set_colors_nowait(device, colors)
+
     def set_breathe(self, device, color, speed, brightness):
         self._log("Setting breathe at device '{}' to color:'{}' speed:{} brightness:{}".format(device, color, speed, brightness))
         self.proxy.set_breathe(
@@ -1365,6 +3582,45 @@ class GlightClient(GlightRemoteCommon):
             self.marshall_num_par(speed),
             self.marshall_num_par(brightness))
 
+    def set_brightness(self, device, brightness):
+        self._log("Setting brightness at device '{}' to {}".format(device, brightness))
+        self.proxy.set_brightness(device, self.marshall_num_par(brightness))
+
+    def set_frame(self, device, colors, mode=None, speed=None, brightness=None):
+        self._log("Setting frame at device '{}' to colors:{} mode:'{}' speed:{} brightness:{}".format(
+            device, colors, mode, speed, brightness))
+        self.proxy.set_frame(
+            device,
+            colors,
+            mode or "",
+            self.marshall_num_par(speed),
+            self.marshall_num_par(brightness))
+
+    def set_frame_nowait(self, device, colors, mode=None, speed=None, brightness=None):
+        """Returns as soon as the service has queued the frame"""
+        self._log("Queueing frame at device '{}' to colors:{} mode:'{}' speed:{} brightness:{}".format(
+            device, colors, mode, speed, brightness))
+        self.proxy.set_frame_nowait(
+            device,
+            colors,
+            mode or "",
+            self.marshall_num_par(speed),
+            self.marshall_num_par(brightness))
+
+    def list_effects(self):
+        return self.proxy.list_effects()
+
+    def start_effect(self, device, effect_name, params=None):
+        """
+        :param params: dict parameters of the effect
+        """
+        self._log("Starting effect '{}' at device '{}' with {}".format(effect_name, device, params))
+        self.proxy.start_effect(device, effect_name, json.dumps(params or {}))
+
+    def stop_effect(self, device):
+        self._log("Stopping effect at device '{}'".format(device))
+        self.proxy.stop_effect(device)
+
     def echo(self, s):
         return self.proxy.echo(s)
 
@@ -1433,11 +3689,14 @@ class GlightApp(object):
         argsparser.add_argument('-c', '--color',   dest='colors',  nargs='+', action='store', help='set color(s)', metavar='color')
         argsparser.add_argument('-x', '--cycle',   dest='cycle',   nargs='+', action='store', help='set color cycle animation',  metavar='#X') #,  metavar='speed [brightness]')
         argsparser.add_argument('-b', '--breathe', dest='breathe', nargs='+', action='store', help='set breathing animation',  metavar='#B') #, metavar='color [speed [brightness]]')
-        argsparser.add_argument('--backend',       dest='backend', nargs=1,   action='store', help='set backend (usb1, pyusb), usb1 is strongly recommended', metavar='(usb1|pyusb)')
+        argsparser.add_argument('--backend',       dest='backend', nargs=1,   action='store', help='set backend (usb1, pyusb, fake), usb1 is strongly recommended, fake simulates the devices', metavar='(usb1|pyusb|fake)')
+        argsparser.add_argument('--session-bus',   dest='session_bus', action='store_const', const=True, help='use the session bus instead of the system bus')
 
         argsparser.add_argument('--state-file',    dest='state_file', nargs='?', action='store', help='file where the state is saved', metavar='filename')
         argsparser.add_argument('--load-state',    dest='load_state', action='store_const', const=True, help='load state from state file')
         argsparser.add_argument('--save-state',    dest='save_state', action='store_const', const=True, help='save state to state file')
+        argsparser.add_argument('--state-format',  dest='state_format', nargs='?', action='store', choices=['json', 'binary'], help='format of the saved state file', metavar='format')
+        argsparser.add_argument('--autosave',      dest='autosave', nargs='?', action='store', type=float, const=2.0, help='service saves the state file after changes', metavar='delay')
 
         argsparser.add_argument('-C', '--client',  dest='client',  action='store_const', const=True, help='run as client')
         argsparser.add_argument('--service',       dest='service', action='store_const', const=True, help='run as service')
@@ -1515,8 +3774,14 @@ class GlightApp(object):
     @staticmethod
     def handle(args, verbose=False):
         """"""
+        if args.session_bus:
+            GlightRemoteCommon.use_session_bus = True
+
         if args.service:
-            srv = GlightService(state_file=args.state_file, verbose=verbose)
+            backend_type = args.backend[0] if args.backend is not None else None
+            srv = GlightService(state_file=args.state_file, verbose=verbose,
+                                state_format=args.state_format, autosave_delay=args.autosave,
+                                backend_type=backend_type)
             srv.run()
             sys.exit(0) # Ends here
 
@@ -1525,6 +3790,8 @@ class GlightApp(object):
             if args.client:
                 backend_type = GlightController.BACKEND_DBUS
             client = GlightController(backend_type, verbose=verbose)
+            if args.state_format is not None and client.is_con_local:
+                client.device_registry.state_format = args.state_format
 
             # Saving state
             if args.load_state:
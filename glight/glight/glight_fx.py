@@ -29,11 +29,18 @@ import json
 import os
 
 import argparse
-from time import sleep
+from time import sleep, monotonic
 import traceback
 
 import psutil  # http://pythonhosted.org/psutil/
 import colorsys
+from bisect import bisect_right
+from threading import Event
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import glight
 
@@ -41,20 +48,32 @@ app_version = "0.1"
 
 
 class ColorUtils(object):
+    """
+    Colors are hex strings ("rrggbb") or triplets of floats 0..1. The batch functions take and return lists and use
+    NumPy when it is installed.
+    """
 
     @staticmethod
     def lerp(val, max_val, start_val, end_val):
         return start_val + (end_val - start_val) * val / max_val
 
     @staticmethod
-    def lerp3(val, max_val, (s1, s2, s3), (e1, e2, e3)):
+    def lerp3(val, max_val, start_triplet, end_triplet):
+        s1, s2, s3 = start_triplet
+        e1, e2, e3 = end_triplet
         r1 = ColorUtils.lerp(val, max_val, s1, e1)
         r2 = ColorUtils.lerp(val, max_val, s2, e2)
         r3 = ColorUtils.lerp(val, max_val, s3, e3)
         return r1, r2, r3
 
     @staticmethod
-    def col_hex_to_triplet(col_hex):
+    def lerp_hue(val, max_val, start_hue, end_hue):
+        """Interpolates hues 0..1 along the shorter arc of the color wheel"""
+        delta = (end_hue - start_hue + 0.5) % 1.0 - 0.5
+        return (start_hue + delta * val / max_val) % 1.0
+
+    @staticmethod
+    def normalize_hex(col_hex):
         col_hex = col_hex or ""
 
         if len(col_hex) > 6:
@@ -62,12 +81,12 @@ class ColorUtils(object):
         elif len(col_hex) < 6:
             col_hex = col_hex.ljust(6, "0")
 
-        rgb = [0, 0, 0]
-        for i in range(0, 3):
-            col_int = float(int(col_hex[i*2:i*2+2], 16))
-            rgb[i] = col_int/255.0
+        return col_hex
 
-        return tuple(rgb)
+    @staticmethod
+    def col_hex_to_triplet(col_hex):
+        rgb = bytearray.fromhex(ColorUtils.normalize_hex(col_hex))
+        return rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0
 
     @staticmethod
     def col_triplet_to_hex(col_triplet):
@@ -76,34 +95,188 @@ class ColorUtils(object):
             int(round(col_triplet[1] * 255)),
             int(round(col_triplet[2] * 255)))
 
+    @staticmethod
+    def cols_hex_to_triplets(col_hexes):
+        """
+        :param col_hexes: str[]
+        :return: (float, float, float)[]
+        """
+        rgb = bytes.fromhex("".join(ColorUtils.normalize_hex(col_hex) for col_hex in col_hexes))
+        if numpy is not None and len(rgb) > 0:
+            return (numpy.frombuffer(rgb, dtype=numpy.uint8).reshape(-1, 3) / 255.0).tolist()
+
+        return [(rgb[i] / 255.0, rgb[i + 1] / 255.0, rgb[i + 2] / 255.0) for i in range(0, len(rgb), 3)]
+
+    @staticmethod
+    def cols_triplets_to_hex(col_triplets):
+        """
+        :param col_triplets: (float, float, float)[]
+        :return: str[]
+        """
+        if numpy is not None and len(col_triplets) > 0:
+            rgb = numpy.rint(numpy.clip(numpy.asarray(col_triplets, dtype=float), 0.0, 1.0) * 255).astype(numpy.uint8)
+            hexes = rgb.tobytes().hex()
+            return [hexes[i:i + 6] for i in range(0, len(hexes), 6)]
+
+        return [ColorUtils.col_triplet_to_hex(col_triplet) for col_triplet in col_triplets]
+
+    @staticmethod
+    def rgbs_to_hsvs(col_triplets):
+        """
+        :param col_triplets: (float, float, float)[] rgb
+        :return: (float, float, float)[] hsv
+        """
+        if numpy is None or len(col_triplets) == 0:
+            return [colorsys.rgb_to_hsv(*col_triplet) for col_triplet in col_triplets]
+
+        rgb = numpy.asarray(col_triplets, dtype=float)
+        r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+        max_c = rgb.max(axis=1)
+        delta = max_c - rgb.min(axis=1)
+        safe_delta = numpy.where(delta > 0, delta, 1.0)
+        s = numpy.where(max_c > 0, delta / numpy.where(max_c > 0, max_c, 1.0), 0.0)
+
+        rc = (max_c - r) / safe_delta
+        gc = (max_c - g) / safe_delta
+        bc = (max_c - b) / safe_delta
+        h = numpy.where(r == max_c, bc - gc, numpy.where(g == max_c, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = numpy.where(delta > 0, (h / 6.0) % 1.0, 0.0)
+
+        return numpy.stack((h, s, max_c), axis=1).tolist()
+
+    @staticmethod
+    def hsvs_to_rgbs(col_triplets):
+        """
+        :param col_triplets: (float, float, float)[] hsv
+        :return: (float, float, float)[] rgb
+        """
+        if numpy is None or len(col_triplets) == 0:
+            return [colorsys.hsv_to_rgb(*col_triplet) for col_triplet in col_triplets]
+
+        hsv = numpy.asarray(col_triplets, dtype=float)
+        h, s, v = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+        sector = numpy.floor(h * 6.0)
+        f = h * 6.0 - sector
+        p = v * (1.0 - s)
+        q = v * (1.0 - s * f)
+        t = v * (1.0 - s * (1.0 - f))
+        sector = sector.astype(int) % 6
+
+        r = numpy.choose(sector, [v, q, p, p, t, v])
+        g = numpy.choose(sector, [t, v, v, q, p, p])
+        b = numpy.choose(sector, [p, p, t, v, v, q])
+        return numpy.stack((r, g, b), axis=1).tolist()
+
+    @staticmethod
+    def srgb_to_linear(c):
+        if c <= 0.04045:
+            return c / 12.92
+        return ((c + 0.055) / 1.055) ** 2.4
+
+    @staticmethod
+    def linear_to_srgb(c):
+        if c <= 0.0031308:
+            return c * 12.92
+        return 1.055 * c ** (1.0 / 2.4) - 0.055
+
+    @staticmethod
+    def blend_hex(base_hex, col_hex, mode, opacity=1.0):
+        """
+        Blends in linear light
+        :param base_hex: str color below
+        :param col_hex: str color on top
+        :param mode: str Layer.BLEND_*
+        :param opacity: float 0..1 of the color on top
+        :return: str hex color
+        """
+        if mode == Layer.BLEND_NORMAL and opacity >= 1.0:
+            return col_hex
+
+        base = [ColorUtils.srgb_to_linear(c) for c in ColorUtils.col_hex_to_triplet(base_hex)]
+        col = [ColorUtils.srgb_to_linear(c) for c in ColorUtils.col_hex_to_triplet(col_hex)]
+        if mode == Layer.BLEND_ADD:
+            blended = [min(1.0, b + c) for b, c in zip(base, col)]
+        elif mode == Layer.BLEND_MULTIPLY:
+            blended = [b * c for b, c in zip(base, col)]
+        elif mode == Layer.BLEND_SCREEN:
+            blended = [1.0 - (1.0 - b) * (1.0 - c) for b, c in zip(base, col)]
+        elif mode == Layer.BLEND_MAX:
+            blended = [max(b, c) for b, c in zip(base, col)]
+        else:
+            blended = col
+
+        return ColorUtils.col_triplet_to_hex(
+            [ColorUtils.linear_to_srgb(b + (c - b) * opacity) for b, c in zip(base, blended)])
+
     @staticmethod
     def color_lerp(val, max_val, rgb_start, rgb_end):
+        """
+        Interpolates in HSV, the hue along the shorter arc. A grey end takes the hue of the other end, a black end the
+        hue and the saturation.
+        """
+        hsv_start, hsv_end = ColorUtils.get_hsv_ends(rgb_start, rgb_end)
+        return colorsys.hsv_to_rgb(
+            ColorUtils.lerp_hue(val, max_val, hsv_start[0], hsv_end[0]),
+            ColorUtils.lerp(val, max_val, hsv_start[1], hsv_end[1]),
+            ColorUtils.lerp(val, max_val, hsv_start[2], hsv_end[2]))
+
+    @staticmethod
+    def color_lerp_batch(values, max_val, rgb_start, rgb_end):
+        """
+        color_lerp() for many values
+        :param values: float[] 0..max_val
+        :return: (float, float, float)[] rgb
+        """
+        hsv_start, hsv_end = ColorUtils.get_hsv_ends(rgb_start, rgb_end)
+        return ColorUtils.hsvs_to_rgbs([(ColorUtils.lerp_hue(val, max_val, hsv_start[0], hsv_end[0]),
+                                         ColorUtils.lerp(val, max_val, hsv_start[1], hsv_end[1]),
+                                         ColorUtils.lerp(val, max_val, hsv_start[2], hsv_end[2])) for val in values])
+
+    @staticmethod
+    def get_hsv_ends(rgb_start, rgb_end):
         hsv_start = colorsys.rgb_to_hsv(rgb_start[0], rgb_start[1], rgb_start[2])
         hsv_end   = colorsys.rgb_to_hsv(rgb_end[0],   rgb_end[1],   rgb_end[2])
 
-        hsv = ColorUtils.lerp3(val, max_val, hsv_start, hsv_end)
-        rgb = colorsys.hsv_to_rgb(hsv[0], hsv[1], hsv[2])
+        # grey has no hue and black neither hue nor saturation
+        if hsv_start[2] == 0:
+            hsv_start = (hsv_end[0], hsv_end[1], hsv_start[2])
+        elif hsv_start[1] == 0:
+            hsv_start = (hsv_end[0], hsv_start[1], hsv_start[2])
+        if hsv_end[2] == 0:
+            hsv_end = (hsv_start[0], hsv_start[1], hsv_end[2])
+        elif hsv_end[1] == 0:
+            hsv_end = (hsv_start[0], hsv_end[1], hsv_end[2])
 
-        return rgb
-        # rgb_triplet_to_display= hsv_to_rgb(transition3(value, maximum, start_triplet, end_triplet))
+        return hsv_start, hsv_end
 
 
 class ColorScale(object):
+    """
+    Maps values to colors interpolated between color points. get_colors() looks the colors up in a table compiled on
+    first use, get_color() interpolates exactly.
+    """
+
+    DEFAULT_LUT_SIZE = 256
 
-    def __init__(self, colors=None, value_points=None, is_percent_based=False):
+    def __init__(self, colors=None, value_points=None, is_percent_based=False, lut_size=None):
         """"""
         self.colors = colors or []
         self.value_points = value_points or []
         self.is_percent_based = is_percent_based
+        self.lut_size = max(2, lut_size or ColorScale.DEFAULT_LUT_SIZE)
+        self.lut = None  # str[] hex colors from the first to the last value point
+        self.lut_array = None  # numpy.ndarray of self.lut
 
         if len(self.colors) != len(self.value_points):
-            raise "Number of elements in colors and value_points must be equal"
+            raise ValueError("Number of elements in colors and value_points must be equal")
 
     def add_point(self, value, color):
         if isinstance(color, str):
             color = ColorUtils.col_hex_to_triplet(color)
         self.value_points.append(value)
         self.colors.append(color)
+        self.lut = None
+        self.lut_array = None
 
     def get_color(self, val, max_val):
         if self.is_percent_based:
@@ -121,38 +294,140 @@ class ColorScale(object):
 
             return ColorUtils.color_lerp(sub_value, vrange, color_a[1], color_b[1])
 
+    def get_color_hex(self, val, max_val):
+        return ColorUtils.col_triplet_to_hex(self.get_color(val, max_val))
+
+    def get_colors(self, values, max_val):
+        """
+        :param values: float[]
+        :param max_val: float
+        :return: str[] hex colors from the lookup table
+        """
+        if self.lut is None:
+            self.compile()
+
+        lut_min = self.value_points[0]
+        lut_range = self.value_points[-1] - lut_min
+        if self.is_percent_based:
+            lut_min = lut_min * max_val
+            lut_range = lut_range * max_val
+        lut_scale = (self.lut_size - 1) / float(lut_range or 1)
+        last = self.lut_size - 1
+
+        if self.lut_array is not None:
+            indexes = numpy.rint((numpy.asarray(values, dtype=float) - lut_min) * lut_scale)
+            return self.lut_array[numpy.clip(indexes, 0, last).astype(int)].tolist()
+
+        return [self.lut[min(last, max(0, int(round((value - lut_min) * lut_scale))))] for value in values]
+
+    def compile(self):
+        """
+        Precomputes the lookup table for get_colors(), the same colors get_color() gives. The values between two points
+        are interpolated in one batch.
+        """
+        if len(self.value_points) == 0:
+            raise ValueError("Color scale has no points")
+
+        lut_min = self.value_points[0]
+        lut_step = (self.value_points[-1] - lut_min) / float(self.lut_size - 1)
+        values = [lut_min + i * lut_step for i in range(0, self.lut_size)]
+
+        rgbs = []
+        start = 0
+        while start < len(values):
+            point_a, point_b = self.get_color_tuple_for(values[start])
+            end = start + 1
+            while end < len(values) and values[end] < point_b[0]:
+                end = end + 1
+
+            if point_a[0] == point_b[0]:
+                rgbs.extend([point_a[1]] * (end - start))
+            else:
+                rgbs.extend(ColorUtils.color_lerp_batch([val - point_a[0] for val in values[start:end]],
+                                                        point_b[0] - point_a[0], point_a[1], point_b[1]))
+            start = end
+
+        self.lut = ColorUtils.cols_triplets_to_hex(rgbs)
+        self.lut_array = numpy.array(self.lut, dtype=object) if numpy is not None else None
+
     def get_color_tuple_for(self, val):
-        point_a = [None, None]
-        point_b = [None, None]
-        for i, value_point in enumerate(self.value_points):
-            next_value_point = None
-            if len(self.value_points) > i + 1:
-                next_value_point = self.value_points[i+1]
-
-            if val >= value_point and (next_value_point is None or val < next_value_point):
-
-                point_a[0] = value_point
-                point_a[1] = self.colors[i]
-                if next_value_point is None:
-                    point_b[0] = value_point
-                    point_b[1] = self.colors[i]
-                else:
-                    point_b[0] = self.value_points[i + 1]
-                    point_b[1] = self.colors[i + 1]
-                break
-
-        if point_a[0] is None:
-            point_a[0] = self.value_points[0]
-            point_a[1] = self.colors[0]
+        if len(self.value_points) == 0:
+            raise ValueError("Color scale has no points")
+
+        i = bisect_right(self.value_points, val) - 1
+        if i < 0:
+            i = 0
+        point_a = (self.value_points[i], self.colors[i])
+        if i + 1 < len(self.value_points) and val >= self.value_points[0]:
+            point_b = (self.value_points[i + 1], self.colors[i + 1])
+        else:
             point_b = point_a
 
-        return tuple(point_a), tuple(point_b)
+        return point_a, point_b
+
+
+class Sampler(object):
+    """
+    Reads files of /proc and /sys at most once per tick, so every value source sharing the sampler works on the same
+    snapshot. EffectEngine starts a new tick per frame, without an engine a snapshot expires after max_age seconds.
+    Not thread safe, every EffectEngine has a sampler of its own for the sources of its effects.
+    """
+
+    DEFAULT_MAX_AGE = 0.02  # seconds
+
+    default = None  # type: Sampler
+
+    def __init__(self, max_age=None):
+        """"""
+        self.max_age = max_age if max_age is not None else Sampler.DEFAULT_MAX_AGE
+        self.cache = {}  # path -> (time, content)
+        self.reads = 0
+        self.hits = 0
+
+    @staticmethod
+    def get_default():
+        """
+        :return: Sampler shared by all value sources not given another sampler
+        """
+        if Sampler.default is None:
+            Sampler.default = Sampler()
+        return Sampler.default
+
+    def next_tick(self):
+        self.cache = {}
+
+    def read(self, path):
+        """
+        :return: str content of the file, None if it can not be read
+        """
+        return self.sample(path)[1]
+
+    def sample(self, path):
+        """
+        :return: (float monotonic time of the read, str content or None)
+        """
+        now = monotonic()
+        cached = self.cache.get(path)
+        if cached is not None and now - cached[0] <= self.max_age:
+            self.hits = self.hits + 1
+            return cached
+
+        try:
+            with open(path, "r") as sample_file:
+                content = sample_file.read()
+        except (IOError, OSError):
+            content = None
+        self.reads = self.reads + 1
+
+        self.cache[path] = (now, content)
+        return self.cache[path]
 
 
 class ValueSource(object):
 
-    def __init__(self):
+    def __init__(self, sampler=None):
         """"""
+        self.sampler = sampler or Sampler.get_default()
 
     def get_polling_timeout(self):
         return 2000  # milliseconds
@@ -171,8 +446,8 @@ class ValueSource(object):
 
 class SysLoadSource(ValueSource):
 
-    def __init__(self, load_field=None, initial_load_max=None):
-        super(SysLoadSource, self).__init__()
+    def __init__(self, load_field=None, initial_load_max=None, sampler=None):
+        super(SysLoadSource, self).__init__(sampler=sampler)
 
         self.load_max = initial_load_max or 1.0
         self.load_field = load_field or 0
@@ -193,9 +468,24 @@ class SysLoadSource(ValueSource):
 
 
 class CpuLoadSource(ValueSource):
+    """
+    Load per cpu in percent, computed from the /proc/stat counters since the previous sample, so sampling never blocks
+    """
 
-    def __init__(self):
-        super(CpuLoadSource, self).__init__()
+    PROC_STAT_FILE = "/proc/stat"
+
+    def __init__(self, smoothing=0.0, decimation=1, sampler=None):
+        """
+        :param smoothing: float 0..<1 weight of the previous values in an exponential moving average, 0 disables it
+        :param decimation: int sample only on every n-th call of get_value(), the calls between return the last values
+        """
+        super(CpuLoadSource, self).__init__(sampler=sampler)
+
+        self.smoothing = smoothing or 0.0
+        self.decimation = max(1, decimation or 1)
+        self.calls = 0
+        self.values = None
+        self.last_times = self.read_cpu_times()
 
     def get_dimensions(self):
         return psutil.cpu_count()
@@ -204,44 +494,1007 @@ class CpuLoadSource(ValueSource):
         return 0.0, 100.0
 
     def get_value(self):
-        return self.read_cpu_usage()
+        self.calls = self.calls + 1
+        if self.values is not None and (self.calls - 1) % self.decimation != 0:
+            return self.values
+
+        values = self.read_cpu_usage()
+        if self.values is not None and self.smoothing > 0 and len(values) == len(self.values):
+            values = [old * self.smoothing + new * (1.0 - self.smoothing) for old, new in zip(self.values, values)]
+        self.values = values
+        return values
 
     def read_cpu_usage(self):
-        return psutil.cpu_percent(interval=0.1, percpu=True)
+        """
+        :return: float[] load per cpu since the previous call
+        """
+        times = self.read_cpu_times()
+        if times is None:
+            return psutil.cpu_percent(interval=None, percpu=True)
+
+        last_times = self.last_times or []
+        self.last_times = times
+
+        usage = []
+        for i, (busy, total) in enumerate(times):
+            if i < len(last_times) and total > last_times[i][1]:
+                usage.append(100.0 * (busy - last_times[i][0]) / (total - last_times[i][1]))
+            elif self.values is not None and i < len(self.values):
+                usage.append(self.values[i])
+            else:
+                usage.append(0.0)
+        return usage
+
+    def read_cpu_times(self):
+        """
+        :return: (busy, total)[] jiffies per cpu, None if /proc/stat is not available
+        """
+        content = self.sampler.read(CpuLoadSource.PROC_STAT_FILE)
+        if content is None:
+            return None
+
+        times = []
+        for line in content.splitlines():
+            if not line.startswith("cpu") or line.startswith("cpu "):
+                continue
+            # user nice system idle iowait irq softirq steal, guest time is part of user already
+            fields = [int(field) for field in line.split()[1:9]]
+            total = sum(fields)
+            idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+            times.append((total - idle, total))
+        return times
+
+
+class MemorySource(ValueSource):
+    """Memory in use in percent, or with use_pressure the share of time tasks stalled on memory (PSI avg10)"""
+
+    MEMINFO_FILE = "/proc/meminfo"
+    PRESSURE_FILE = "/proc/pressure/memory"
+
+    def __init__(self, use_pressure=False, sampler=None):
+        super(MemorySource, self).__init__(sampler=sampler)
+        self.use_pressure = use_pressure
+
+    def get_value_range(self, dimension=0):
+        return 0.0, 100.0
+
+    def get_value(self):
+        if self.use_pressure:
+            pressure = self.read_pressure()
+            if pressure is not None:
+                return pressure
+        return self.read_used()
+
+    def read_used(self):
+        content = self.sampler.read(MemorySource.MEMINFO_FILE)
+        if content is None:
+            return 0.0
+
+        meminfo = {}
+        for line in content.splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                meminfo[parts[0].rstrip(":")] = int(parts[1])
+
+        total = meminfo.get("MemTotal", 0)
+        available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+        if total == 0:
+            return 0.0
+        return 100.0 * (total - available) / total
+
+    def read_pressure(self):
+        content = self.sampler.read(MemorySource.PRESSURE_FILE)
+        if content is None:
+            return None
+
+        for line in content.splitlines():
+            parts = line.split()
+            if len(parts) > 1 and parts[0] == "some":
+                for part in parts[1:]:
+                    if part.startswith("avg10="):
+                        return float(part[len("avg10="):])
+        return None
+
+
+class RateSource(ValueSource):
+    """Rates of growing counters, normalized by the highest rate seen so far"""
+
+    def __init__(self, initial_rate_max=None, sampler=None):
+        super(RateSource, self).__init__(sampler=sampler)
+        self.rate_max = initial_rate_max or 1.0
+        self.last_counters = None
+        self.last_time = None
+
+    def get_polling_timeout(self):
+        return 1000  # milliseconds
+
+    def get_value_range(self, dimension=0):
+        return 0.0, 1.0
+
+    def get_value(self):
+        sample_time, counters = self.read_counters()
+        if self.last_counters is None or sample_time <= self.last_time or len(counters) != len(self.last_counters):
+            rates = [0.0] * len(counters)
+        else:
+            rates = [max(0.0, (counter - last) / (sample_time - self.last_time))
+                     for counter, last in zip(counters, self.last_counters)]
+
+        self.last_time = sample_time
+        self.last_counters = counters
+        self.rate_max = max([self.rate_max] + rates)
+        return [rate / self.rate_max for rate in rates]
+
+    def read_counters(self):
+        """
+        :return: (float time of the sample, float[] counters)
+        """
+        return monotonic(), []
+
+
+class DiskIoSource(RateSource):
+    """Bytes read and written per second, summed over the disks"""
+
+    DISKSTATS_FILE = "/proc/diskstats"
+    BLOCK_DIR = "/sys/block"
+    SECTOR_SIZE = 512
+
+    def __init__(self, disks=None, initial_rate_max=None, sampler=None):
+        """
+        :param disks: str[] names of the disks, defaults to all block devices but loop, ram and zram devices
+        """
+        super(DiskIoSource, self).__init__(initial_rate_max=initial_rate_max, sampler=sampler)
+        if disks is None:
+            try:
+                disks = [disk for disk in os.listdir(DiskIoSource.BLOCK_DIR)
+                         if not disk.startswith(("loop", "ram", "zram"))]
+            except OSError:
+                disks = []
+        self.disks = set(disks)
+
+    def get_dimensions(self):
+        return 2
+
+    def read_counters(self):
+        sample_time, content = self.sampler.sample(DiskIoSource.DISKSTATS_FILE)
+        read_bytes = 0
+        written_bytes = 0
+        for line in (content or "").splitlines():
+            fields = line.split()
+            if len(fields) >= 10 and fields[2] in self.disks:
+                read_bytes = read_bytes + int(fields[5]) * DiskIoSource.SECTOR_SIZE
+                written_bytes = written_bytes + int(fields[9]) * DiskIoSource.SECTOR_SIZE
+        return sample_time, [read_bytes, written_bytes]
+
+
+class NetworkSource(RateSource):
+    """Bytes received and sent per second, summed over the interfaces"""
+
+    NET_DEV_FILE = "/proc/net/dev"
+
+    def __init__(self, interfaces=None, initial_rate_max=None, sampler=None):
+        """
+        :param interfaces: str[] names of the interfaces, defaults to all but the loopback
+        """
+        super(NetworkSource, self).__init__(initial_rate_max=initial_rate_max, sampler=sampler)
+        self.interfaces = set(interfaces) if interfaces else None
+
+    def get_dimensions(self):
+        return 2
+
+    def read_counters(self):
+        sample_time, content = self.sampler.sample(NetworkSource.NET_DEV_FILE)
+        received = 0
+        sent = 0
+        for line in (content or "").splitlines()[2:]:
+            interface, _, counters = line.partition(":")
+            interface = interface.strip()
+            counters = counters.split()
+            if len(counters) < 9:
+                continue
+            if (self.interfaces is None and interface != "lo") or \
+                    (self.interfaces is not None and interface in self.interfaces):
+                received = received + int(counters[0])
+                sent = sent + int(counters[8])
+        return sample_time, [received, sent]
+
+
+class TemperatureSource(ValueSource):
+    """Temperatures of the hwmon sensors in degrees celsius"""
+
+    HWMON_DIR = "/sys/class/hwmon"
+
+    def __init__(self, sensors=None, temp_range=None, sampler=None):
+        """
+        :param sensors: str[] hwmon names (e.g. coretemp, k10temp) to read, defaults to all
+        :param temp_range: (float, float) temperatures mapped to the low and the high end
+        """
+        super(TemperatureSource, self).__init__(sampler=sampler)
+        self.temp_range = temp_range or (30.0, 90.0)
+        self.inputs = self.find_inputs(sensors)
+
+    def find_inputs(self, sensors=None):
+        """
+        :return: str[] paths of the temperature inputs
+        """
+        inputs = []
+        try:
+            hwmons = sorted(os.listdir(TemperatureSource.HWMON_DIR))
+        except OSError:
+            return inputs
+
+        for hwmon in hwmons:
+            hwmon_dir = os.path.join(TemperatureSource.HWMON_DIR, hwmon)
+            name = (self.sampler.read(os.path.join(hwmon_dir, "name")) or "").strip()
+            if sensors is not None and name not in sensors:
+                continue
+            try:
+                files = sorted(os.listdir(hwmon_dir))
+            except OSError:
+                continue
+            inputs.extend(os.path.join(hwmon_dir, filename) for filename in files
+                          if filename.startswith("temp") and filename.endswith("_input"))
+        return inputs
+
+    def get_dimensions(self):
+        return len(self.inputs)
+
+    def get_value_range(self, dimension=0):
+        return self.temp_range
 
+    def get_value(self):
+        temps = []
+        for path in self.inputs:
+            content = self.sampler.read(path)
+            temps.append(int(content) / 1000.0 if content else 0.0)
+        return temps
+
+
+class PrometheusFileSource(ValueSource):
+    """Values of metrics in a file of the Prometheus text format, e.g. written for the node exporter textfile collector"""
+
+    def __init__(self, filename, metrics, value_range=None, sampler=None):
+        """
+        :param filename: str
+        :param metrics: str[] series as written in the file, e.g. node_load1 or disk_used{mount="/"}
+        :param value_range: (float, float)
+        """
+        super(PrometheusFileSource, self).__init__(sampler=sampler)
+        self.filename = filename
+        self.metrics = metrics
+        self.value_range = value_range or (0.0, 1.0)
+
+    def get_dimensions(self):
+        return len(self.metrics)
+
+    def get_value_range(self, dimension=0):
+        return self.value_range
+
+    def get_value(self):
+        values = PrometheusFileSource.parse(self.sampler.read(self.filename) or "")
+        return [values.get(metric, 0.0) for metric in self.metrics]
+
+    @staticmethod
+    def parse(content):
+        """
+        :return: dict series -> float
+        """
+        values = {}
+        for line in content.splitlines():
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            # the value follows the series, an optional timestamp follows the value
+            series_end = line.rfind("}") + 1 if "}" in line else line.find(" ")
+            parts = line[series_end:].split()
+            if series_end <= 0 or len(parts) == 0:
+                continue
+            try:
+                values[line[:series_end].strip()] = float(parts[0])
+            except ValueError:
+                continue
+        return values
 
-class GlightEffect(object):
 
-    def __init__(self, client):
+class FrameStats(object):
+    """Timing statistics of a FrameLoop, times in seconds"""
+
+    def __init__(self):
         """"""
-        self.client = client
+        self.frames = 0
+        self.skipped = 0
+        self.render_time = 0.0
+        self.send_time = 0.0
+        self.jitter = 0.0
+        self.max_render_time = 0.0
+        self.max_send_time = 0.0
+        self.max_jitter = 0.0
+
+    def add_frame(self, render_time, send_time, jitter):
+        self.frames = self.frames + 1
+        self.render_time = self.render_time + render_time
+        self.send_time = self.send_time + send_time
+        self.jitter = self.jitter + jitter
+        self.max_render_time = max(self.max_render_time, render_time)
+        self.max_send_time = max(self.max_send_time, send_time)
+        self.max_jitter = max(self.max_jitter, jitter)
+
+    def get_averages(self):
+        """
+        :return: avg render time, avg send time, avg jitter
+        """
+        if self.frames == 0:
+            return 0.0, 0.0, 0.0
+        return self.render_time / self.frames, self.send_time / self.frames, self.jitter / self.frames
+
+    def __str__(self):
+        render_time, send_time, jitter = self.get_averages()
+        return "frames:{} skipped:{} render:{:.1f}/{:.1f}ms send:{:.1f}/{:.1f}ms jitter:{:.1f}/{:.1f}ms (avg/max)".format(
+            self.frames, self.skipped,
+            render_time * 1000, self.max_render_time * 1000,
+            send_time * 1000, self.max_send_time * 1000,
+            jitter * 1000, self.max_jitter * 1000)
+
+
+class FrameLoop(object):
+    """
+    Renders and sends frames at a fixed rate. Deadlines are derived from the start time on the monotonic clock, so the
+    time spent rendering and sending does not add up to a drift. Frames whose deadline passed already are skipped.
+    """
+
+    DEFAULT_FPS = 30.0
+
+    def __init__(self, fps=None, verbose=False, stop_event=None):
+        """
+        :param stop_event: threading.Event which stops the loop once set, so stopping does not wait for the next frame
+        """
+        self.verbose = verbose
+        self.fps = fps or FrameLoop.DEFAULT_FPS
+        self.period = 1.0 / self.fps
+        self.running = False
+        self.stop_event = stop_event or Event()
+        self.stats = FrameStats()
+
+    def run(self, render, send, max_frames=None):
+        """
+        :param render: callable taking the seconds since the start, returns the frame
+        :param send: callable taking the rendered frame
+        :param max_frames: int stop after that many frames, None runs until stop() is called
+        """
+        self.running = True
+        start_time = monotonic()
+        frame_no = 0
+
+        try:
+            while not self.stop_event.is_set() and (max_frames is None or self.stats.frames < max_frames):
+                deadline = start_time + frame_no * self.period
+                now = monotonic()
+                if now < deadline:
+                    if self.stop_event.wait(deadline - now):
+                        break
+                    now = monotonic()
+                elif now - deadline >= self.period:
+                    behind = int((now - deadline) / self.period)
+                    frame_no = frame_no + behind
+                    deadline = deadline + behind * self.period
+                    self.stats.skipped = self.stats.skipped + behind
+
+                frame = render(now - start_time)
+                rendered_at = monotonic()
+                send(frame)
+                sent_at = monotonic()
+
+                self.stats.add_frame(rendered_at - now, sent_at - rendered_at, now - deadline)
+                frame_no = frame_no + 1
+        finally:
+            self.running = False
+            self._log("Frame loop stopped {}".format(self.stats))
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
+
+
+class Easing(object):
+    """Easing functions mapping the progress 0..1 of a transition"""
 
-class CpuxEffect(GlightEffect):
+    @staticmethod
+    def linear(x):
+        return x
 
-    def run(self):
-        vsrc = CpuLoadSource()
-        vsrc_range = vsrc.get_value_range()
+    @staticmethod
+    def ease_in(x):
+        return x * x
 
-        col_scale = ColorScale()
-        col_scale.add_point(0.0,   "0000ff")
-        col_scale.add_point(100.0, "ff0000")
+    @staticmethod
+    def ease_out(x):
+        return x * (2.0 - x)
 
-        vals = None
-        while True:
-            if vals is not None:
-                sleep(vsrc.get_polling_timeout() / 1000)
+    @staticmethod
+    def ease_in_out(x):
+        return x * x * (3.0 - 2.0 * x)
 
-            vals = vsrc.get_value()
+    @staticmethod
+    def step(x):
+        return 1.0 if x >= 1.0 else 0.0
 
-            for device in args.device:
-                colors = []
-                for i, cpu_percent in enumerate(vals):
-                    col3 = col_scale.get_color(cpu_percent, vsrc_range[1])
-                    colors.append(ColorUtils.col_triplet_to_hex(col3))
+    @staticmethod
+    def get(name):
+        easing = {
+            "linear": Easing.linear,
+            "ease_in": Easing.ease_in,
+            "ease_out": Easing.ease_out,
+            "ease_in_out": Easing.ease_in_out,
+            "step": Easing.step
+        }.get(name or "linear")
+        if easing is None:
+            raise ValueError("Unknown easing '{}'".format(name))
+        return easing
+
+
+class Keyframe(object):
+
+    def __init__(self, time, colors, easing=None):
+        """
+        :param time: float seconds from the start of the animation
+        :param colors: dict field -> hex color, or str[] with one color for the device or one color per field
+        :param easing: str name of the easing of the transition to the next keyframe
+        """
+        self.time = float(time)
+        if isinstance(colors, dict):
+            self.colors = dict((int(field), color) for field, color in colors.items())
+        elif len(colors) == 1:
+            self.colors = {0: colors[0]}
+        else:
+            self.colors = dict((i + 1, color) for i, color in enumerate(colors))
+        self.easing = Easing.get(easing)
+
+
+class Animation(object):
+    """
+    Keyframes precomputed at a fixed frame rate. The colors are kept as rgb bytes in one array, the frames handed out
+    are built once on compile, so playing back does not compute anything.
+    """
+
+    def __init__(self, keyframes, fps=None):
+        """
+        :param keyframes: Keyframe[]
+        :param fps: float frame rate of the precomputed frames
+        """
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe.time)
+        self.fps = fps or FrameLoop.DEFAULT_FPS
+        self.fields = []  # int[] fields of the frames
+        self.buffer = array.array("B")  # rgb per field per frame
+        self.frames = []  # dict field -> hex color per frame, equal consecutive frames share the dict
+        self.compile()
+
+    @staticmethod
+    def from_json(anim_json):
+        """
+        :param anim_json: str {"fps": 30, "keyframes": [{"time": 0.0, "colors": ["ff0000"], "easing": "ease_in"}, ...]}
+        :return: Animation
+        """
+        anim = json.loads(anim_json)
+        keyframes = [Keyframe(keyframe["time"], keyframe["colors"], keyframe.get("easing"))
+                     for keyframe in anim.get("keyframes", [])]
+        return Animation(keyframes, fps=anim.get("fps"))
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "r") as anim_file:
+            return Animation.from_json(anim_file.read())
+
+    def get_frame_count(self):
+        return len(self.frames)
+
+    def get_duration(self):
+        return len(self.frames) / self.fps
+
+    def get_frame(self, index):
+        """
+        :return: dict field -> hex color
+        """
+        return self.frames[index]
+
+    def compile(self):
+        if len(self.keyframes) == 0:
+            raise ValueError("Animation has no keyframes")
+
+        self.fields = sorted(set(field for keyframe in self.keyframes for field in keyframe.colors.keys()))
+
+        # colors of every field at every keyframe, fields missing in a keyframe keep their color
+        key_colors = []
+        last_colors = dict((field, (0.0, 0.0, 0.0)) for field in self.fields)
+        for keyframe in self.keyframes:
+            colors = {}
+            for field in self.fields:
+                color = keyframe.colors.get(field, keyframe.colors.get(0))
+                colors[field] = ColorUtils.col_hex_to_triplet(color) if color is not None else last_colors[field]
+            key_colors.append(colors)
+            last_colors = colors
+
+        start_time = self.keyframes[0].time
+        frame_count = int(round((self.keyframes[-1].time - start_time) * self.fps)) + 1
+
+        self.buffer = array.array("B", bytes(frame_count * len(self.fields) * 3))
+        self.frames = []
+        segment = 0
+        for index in range(0, frame_count):
+            time = start_time + index / self.fps
+            while segment + 1 < len(self.keyframes) - 1 and time >= self.keyframes[segment + 1].time:
+                segment = segment + 1
+
+            if segment + 1 < len(self.keyframes):
+                key_a, key_b = self.keyframes[segment], self.keyframes[segment + 1]
+                span = key_b.time - key_a.time
+                progress = key_a.easing(min(1.0, (time - key_a.time) / span)) if span > 0 else 1.0
+                colors_a, colors_b = key_colors[segment], key_colors[segment + 1]
+            else:
+                progress = 0.0
+                colors_a = colors_b = key_colors[segment]
+
+            offset = index * len(self.fields) * 3
+            for field in self.fields:
+                for channel in range(0, 3):
+                    value = colors_a[field][channel] + (colors_b[field][channel] - colors_a[field][channel]) * progress
+                    self.buffer[offset] = int(round(max(0.0, min(1.0, value)) * 255))
+                    offset = offset + 1
+
+            self.frames.append(self.decode_frame(index))
+
+    def decode_frame(self, index):
+        frame_size = len(self.fields) * 3
+        offset = index * frame_size
+        rgb = self.buffer[offset:offset + frame_size]
+        if index > 0 and rgb == self.buffer[offset - frame_size:offset]:
+            return self.frames[index - 1]
+
+        return dict((field, "{:02x}{:02x}{:02x}".format(rgb[i * 3], rgb[i * 3 + 1], rgb[i * 3 + 2]))
+                    for i, field in enumerate(self.fields))
+
+
+class Effect(object):
+    """
+    Base of the effects. render(t) returns the frame of the effect as dict device -> dict field -> hex color, field 0
+    colors the whole device.
+    """
+
+    name = None
+
+    field_counts = None  # device -> int color fields, see get_field_count()
+
+    def __init__(self, devices=None, params=None, verbose=False):
+        """
+        :param devices: str[] names of the devices to render for
+        :param params: dict effect specific parameters
+        """
+        self.devices = devices or []
+        self.params = params or {}
+        self.verbose = verbose
+        # the sampler of the engine running the effect, set by EffectEngine.add_layer(), None for the default one
+        self.sampler = None  # type: Sampler
+
+    def get_fps(self):
+        """
+        :return: float frame rate the effect needs, None if it does not care
+        """
+        return None
+
+    def setup(self):
+        """Called before the first frame"""
+
+    def render(self, t):
+        """
+        :param t: float seconds since the start
+        :return: dict device -> dict field -> str
+        """
+        return {}
+
+    def teardown(self):
+        """Called after the last frame"""
+
+    def get_param(self, name, default=None, param_type=str):
+        value = self.params.get(name)
+        if value is None:
+            return default
+        return param_type(value)
+
+    @staticmethod
+    def get_field_count(device):
+        """
+        :param device: str name of a device
+        :return: int color fields of the device, 0 if it has one color only, None for unknown devices
+        """
+        if Effect.field_counts is None:
+            Effect.field_counts = dict((known_device.device_name_short, known_device.max_color_fields)
+                                       for known_device in glight.GDeviceRegistry().known_devices)
+        return Effect.field_counts.get(device)
+
+    @staticmethod
+    def fold_values(values, field_count):
+        """
+        Averages consecutive values when there are more values than fields, e.g. 8 cpus on 6 fields
+        :param values: float[]
+        :param field_count: int fields to fold to, 0 folds to one value, None keeps the values
+        :return: float[]
+        """
+        count = max(field_count, 1) if field_count is not None else len(values)
+        if len(values) <= count:
+            return values
+
+        folded = []
+        for i in range(0, count):
+            group = values[i * len(values) // count:(i + 1) * len(values) // count]
+            folded.append(sum(group) / len(group))
+        return folded
+
+
+class SolidEffect(Effect):
+    """All devices in one color, e.g. as base of other layers"""
+
+    name = "solid"
+
+    def render(self, t):
+        color = self.get_param("color", "ffffff")
+        return dict((device, {0: color}) for device in self.devices)
+
+
+class CpuxEffect(Effect):
+    """Load per cpu, one field per cpu"""
+
+    name = "cpux"
 
-                self.client.set_colors(device, colors)
-                if args.verbose:
-                    print("Colors updated {}".format(colors))
+    def __init__(self, devices=None, params=None, verbose=False):
+        """"""
+        super(CpuxEffect, self).__init__(devices=devices, params=params, verbose=verbose)
+        self.vsrc = None  # type: CpuLoadSource
+        self.col_scale = None  # type: ColorScale
+
+    def get_fps(self):
+        if self.vsrc is None:
+            return None
+        return 1000.0 / self.vsrc.get_polling_timeout()
+
+    def setup(self):
+        self.vsrc = CpuLoadSource(
+            smoothing=self.get_param("smoothing", 0.0, float),
+            decimation=self.get_param("decimation", 1, int),
+            sampler=self.sampler)
+
+        self.col_scale = ColorScale()
+        self.col_scale.add_point(0.0,   self.get_param("color_idle", "0000ff"))
+        self.col_scale.add_point(100.0, self.get_param("color_busy", "ff0000"))
+
+    def render(self, t):
+        values = self.vsrc.get_value()
+        max_val = self.vsrc.get_value_range()[1]
+
+        frame = {}
+        for device in self.devices:
+            field_count = Effect.get_field_count(device)
+            colors = self.col_scale.get_colors(Effect.fold_values(values, field_count), max_val)
+            if field_count == 0:
+                frame[device] = {0: colors[0]} if len(colors) > 0 else {}
+            else:
+                frame[device] = dict((i + 1, color) for i, color in enumerate(colors))
+        return frame
+
+
+class MeterEffect(Effect):
+    """
+    Shows a value source, one value colors the device, several values one field each.
+    Parameters: source (cpu, load, memory, pressure, disk, net, temp, prometheus), color_low, color_high and
+    disks, interfaces, sensors, file, metrics (comma separated lists), min and max for the source
+    """
+
+    name = "meter"
+
+    def __init__(self, devices=None, params=None, verbose=False):
+        """"""
+        super(MeterEffect, self).__init__(devices=devices, params=params, verbose=verbose)
+        self.vsrc = None  # type: ValueSource
+        self.col_scale = None  # type: ColorScale
+
+    def get_list_param(self, name):
+        value = self.get_param(name)
+        return value.split(",") if value else None
+
+    def get_range_param(self):
+        if self.get_param("min") is None and self.get_param("max") is None:
+            return None
+        return self.get_param("min", 0.0, float), self.get_param("max", 100.0, float)
+
+    def create_source(self):
+        source = self.get_param("source", "cpu")
+        if source == "cpu":
+            return CpuLoadSource(sampler=self.sampler)
+        if source == "load":
+            return SysLoadSource(sampler=self.sampler)
+        if source == "memory":
+            return MemorySource(sampler=self.sampler)
+        if source == "pressure":
+            return MemorySource(use_pressure=True, sampler=self.sampler)
+        if source == "disk":
+            return DiskIoSource(disks=self.get_list_param("disks"), sampler=self.sampler)
+        if source == "net":
+            return NetworkSource(interfaces=self.get_list_param("interfaces"),
+                                 sampler=self.sampler)
+        if source == "temp":
+            return TemperatureSource(sensors=self.get_list_param("sensors"), temp_range=self.get_range_param(),
+                                     sampler=self.sampler)
+        if source == "prometheus":
+            return PrometheusFileSource(self.get_param("file"), self.get_list_param("metrics") or [],
+                                        value_range=self.get_range_param(), sampler=self.sampler)
+        raise ValueError("Unknown value source '{}'".format(source))
+
+    def get_fps(self):
+        if self.vsrc is None:
+            return None
+        return 1000.0 / self.vsrc.get_polling_timeout()
+
+    def setup(self):
+        self.vsrc = self.create_source()
+        value_min, value_max = self.vsrc.get_value_range()
+
+        self.col_scale = ColorScale()
+        self.col_scale.add_point(value_min, self.get_param("color_low", "0000ff"))
+        self.col_scale.add_point(value_max if value_max is not None else 1.0, self.get_param("color_high", "ff0000"))
+
+    def render(self, t):
+        values = self.vsrc.get_value()
+        if not isinstance(values, list):
+            values = [values]
+
+        frame = {}
+        for device in self.devices:
+            colors = self.col_scale.get_colors(Effect.fold_values(values, Effect.get_field_count(device)), None)
+            if len(colors) == 1:
+                frame[device] = {0: colors[0]}
+            else:
+                frame[device] = dict((i + 1, color) for i, color in enumerate(colors))
+        return frame
+
+
+class AnimationEffect(Effect):
+    """
+    Plays an animation file on all devices, parameters: file, loop (0/1), tempo (playback speed factor)
+    """
+
+    name = "animation"
+
+    def __init__(self, devices=None, params=None, verbose=False):
+        """"""
+        super(AnimationEffect, self).__init__(devices=devices, params=params, verbose=verbose)
+        self.animation = None  # type: Animation
+        self.loop = True
+        self.tempo = 1.0
+        self.position = 0.0
+        self.last_t = None
+
+    def get_fps(self):
+        if self.animation is None:
+            return None
+        return self.animation.fps * self.tempo
+
+    def setup(self):
+        if self.animation is None:
+            filename = self.get_param("file")
+            if filename is None:
+                raise ValueError("The animation effect needs a file parameter")
+            self.animation = Animation.load(filename)
+        self.loop = self.get_param("loop", 1, int) != 0
+        self.tempo = self.get_param("tempo", 1.0, float)
+        self.position = 0.0
+        self.last_t = None
+
+    def render(self, t):
+        if self.last_t is not None:
+            self.position = self.position + (t - self.last_t) * self.tempo
+        self.last_t = t
+
+        frame_count = self.animation.get_frame_count()
+        index = int(self.position * self.animation.fps)
+        if self.loop:
+            index = index % frame_count
+        else:
+            index = min(index, frame_count - 1)
+
+        frame = self.animation.get_frame(index)
+        return dict((device, frame) for device in self.devices)
+
+
+class Layer(object):
+    """An effect placed in the stack of an EffectEngine"""
+
+    BLEND_NORMAL = "normal"
+    BLEND_ADD = "add"
+    BLEND_MULTIPLY = "multiply"
+    BLEND_SCREEN = "screen"
+    BLEND_MAX = "max"
+
+    BLEND_MODES = [BLEND_NORMAL, BLEND_ADD, BLEND_MULTIPLY, BLEND_SCREEN, BLEND_MAX]
+
+    def __init__(self, effect, blend=None, opacity=1.0, mask=None):
+        """
+        :param effect: Effect
+        :param blend: str one of BLEND_MODES
+        :param opacity: float 0..1
+        :param mask: dict device -> field[] the layer may color, devices missing in the mask are not masked
+        """
+        self.effect = effect
+        self.blend = blend or Layer.BLEND_NORMAL
+        self.opacity = opacity
+        self.mask = mask
+
+        if self.blend not in Layer.BLEND_MODES:
+            raise ValueError("Unknown blend mode '{}'".format(self.blend))
+
+    def is_masked(self, device, field):
+        return self.mask is not None and device in self.mask and field not in self.mask[device]
+
+
+class EffectRegistry(object):
+    """Effect classes by name, effects of other packages are registered by the entry point group 'glight.effects'"""
+
+    ENTRY_POINT_GROUP = "glight.effects"
+
+    def __init__(self, verbose=False):
+        """"""
+        self.verbose = verbose
+        self.effects = {}  # name -> Effect subclass
+
+    def register(self, effect_class, name=None):
+        self.effects[name or effect_class.name] = effect_class
+
+    def get_names(self):
+        return sorted(self.effects.keys())
+
+    def create(self, name, devices=None, params=None):
+        """
+        :return: Effect
+        """
+        if name not in self.effects:
+            raise ValueError("Unknown effect '{}', available: {}".format(name, ", ".join(self.get_names())))
+        return self.effects[name](devices=devices, params=params, verbose=self.verbose)
+
+    def load_entry_points(self):
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+
+        eps = entry_points()
+        if hasattr(eps, "select"):
+            eps = eps.select(group=EffectRegistry.ENTRY_POINT_GROUP)
+        else:
+            eps = eps.get(EffectRegistry.ENTRY_POINT_GROUP, [])
+
+        for ep in eps:
+            try:
+                self.register(ep.load(), ep.name)
+            except Exception as ex:
+                print("Failed to load effect '{}': {}".format(ep.name, ex))
+
+    @staticmethod
+    def get_default(verbose=False):
+        """
+        :return: EffectRegistry with the built in effects and those registered by entry points
+        """
+        registry = EffectRegistry(verbose=verbose)
+        registry.register(SolidEffect)
+        registry.register(CpuxEffect)
+        registry.register(MeterEffect)
+        registry.register(AnimationEffect)
+        registry.load_entry_points()
+        return registry
+
+
+class EffectEngine(object):
+    """
+    Renders the layers of all active effects into one frame per tick and sends it with a single set_frame call per
+    device. Devices whose frame did not change are not sent again.
+    """
+
+    def __init__(self, client, fps=None, verbose=False, sampler=None):
+        """
+        :param client: GlightController
+        :param fps: float frame rate, defaults to the highest rate the effects ask for
+        :param sampler: Sampler of the value sources of the effects, one of its own by default, so engines running on
+                        other threads do not reset its ticks
+        """
+        self.client = client
+        self.fps = fps
+        self.verbose = verbose
+        self.layers = []  # Layer[]
+        self.last_frame = {}  # device -> dict field -> color
+        self.loop = None  # type: FrameLoop
+        self.stop_event = Event()  # set by stop(), also before the loop of run() exists
+        self.is_set_up = False
+        self.sampler = sampler or Sampler()
+
+    def add_layer(self, layer):
+        """
+        :param layer: Layer, rendered on top of the present layers
+        """
+        if layer.effect.sampler is None:
+            layer.effect.sampler = self.sampler
+        self.layers.append(layer)
+
+    def remove_layer(self, layer):
+        self.layers.remove(layer)
+
+    def get_fps(self):
+        if self.fps:
+            return self.fps
+        rates = [layer.effect.get_fps() for layer in self.layers if layer.effect.get_fps()]
+        return max(rates) if len(rates) > 0 else FrameLoop.DEFAULT_FPS
+
+    def render(self, t):
+        """
+        :return: dict device -> dict field -> color
+        """
+        self.sampler.next_tick()
+
+        frame = {}
+        for layer in self.layers:
+            for device, colors in layer.effect.render(t).items():
+                device_frame = frame.setdefault(device, {})
+                for field, color in colors.items():
+                    if field == 0 and len(device_frame) > 0:
+                        # a color of the whole device is blended into every field of the layers below
+                        for below_field, below in list(device_frame.items()):
+                            if not layer.is_masked(device, below_field):
+                                device_frame[below_field] = ColorUtils.blend_hex(
+                                    below, color, layer.blend, layer.opacity)
+                        if 0 in device_frame or layer.is_masked(device, 0):
+                            continue
+                    if layer.is_masked(device, field):
+                        continue
+                    base = device_frame.get(field, device_frame.get(0))
+                    if base is None:
+                        device_frame[field] = color
+                    else:
+                        device_frame[field] = ColorUtils.blend_hex(base, color, layer.blend, layer.opacity)
+        return frame
+
+    def send(self, frame):
+        for device, colors in frame.items():
+            if self.last_frame.get(device) != colors:
+                self.client.set_frame(device, colors)
+                self.last_frame[device] = colors
+                self._log("Frame of '{}' updated {}".format(device, colors))
+
+    def setup(self):
+        """Sets the effects up, e.g. to check their parameters before run() is called on another thread"""
+        if self.is_set_up:
+            return
+        for layer in self.layers:
+            layer.effect.setup()
+        self.is_set_up = True
+
+    def teardown(self):
+        if not self.is_set_up:
+            return
+        self.is_set_up = False
+        for layer in self.layers:
+            layer.effect.teardown()
+
+    def run(self, max_frames=None):
+        self.setup()
+        try:
+            self.loop = FrameLoop(fps=self.get_fps(), verbose=self.verbose, stop_event=self.stop_event)
+            self.loop.run(self.render, self.send, max_frames=max_frames)
+        finally:
+            self.teardown()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
 
 # App handling ----------------------------------------------------------------
 
@@ -266,12 +1519,27 @@ class GlightFxApp(object):
             description='Some color effects using Glight (V' + app_version + ')', add_help=False)
 
         argsparser.add_argument('-d', '--device', dest='device', nargs='*', action='store', help='set devices', metavar='device_name')
-        argsparser.add_argument('-e', '--effect', dest='effect', nargs='?', action='store', help='show effect', metavar='name')
+        argsparser.add_argument('-e', '--effect', dest='effect', nargs='*', action='store',
+                                help='show effects, later ones are layered on top', metavar='name')
+        argsparser.add_argument('-b', '--blend', dest='blend', nargs='?', action='store',
+                                help='blend mode of the upper layers (' + ", ".join(Layer.BLEND_MODES) + ')', metavar='mode')
+        argsparser.add_argument('-p', '--param', dest='param', nargs='*', action='store',
+                                help='effect parameters', metavar='name=value')
+        argsparser.add_argument('-f', '--fps', dest='fps', nargs='?', action='store', type=float, help='frames per second',
+                                metavar='fps')
+        argsparser.add_argument('--smoothing', dest='smoothing', nargs='?', action='store', type=float,
+                                help='weight of the previous values (0..1)', metavar='factor')
+        argsparser.add_argument('--decimation', dest='decimation', nargs='?', action='store', type=int,
+                                help='sample only every n-th frame', metavar='n')
 
         argsparser.add_argument('--experimental', dest='experimental', nargs='?', action='store', help='call experimental function',
                                 metavar='name')
 
         argsparser.add_argument('-C', '--client',  dest='client',  action='store_const', const=True, help='run as client')
+        argsparser.add_argument('-S', '--in-service', dest='in_service', action='store_const', const=True,
+                                help='let the service render the effect')
+        argsparser.add_argument('--stop', dest='stop', action='store_const', const=True,
+                                help='stop the effect rendered by the service')
         argsparser.add_argument('-l', '--list',    dest='do_list', action='store_const', const=True, help='list devices')
         argsparser.add_argument('-v', '--verbose', dest='verbose', action='store_const', const=True, help='be verbose')
         argsparser.add_argument('-h', '--help',    dest='help',    action='store_const', const=True, help='show help')
@@ -306,28 +1574,81 @@ class GlightFxApp(object):
     @staticmethod
     def handle(args, verbose=False):
         """"""
+        if args.in_service or args.stop:
+            GlightFxApp.handle_in_service(args, verbose=verbose)
+            return
+
         backend_type = glight.GlightController.BACKEND_LOCAL
         if args.client:
             backend_type = glight.GlightController.BACKEND_DBUS
         client = glight.GlightController(backend_type, verbose=verbose)
 
         if args.device is None:
-            raise "Need at least a device"
+            raise ValueError("Need at least a device")
 
-        if args.effect == "cpux":
-            fx = CpuxEffect(client)
+        params = GlightFxApp.get_params(args)
 
-            state = client.get_state()
+        registry = EffectRegistry.get_default(verbose=verbose)
+        engine = EffectEngine(client, fps=args.fps, verbose=verbose)
+        for i, effect_name in enumerate(args.effect or []):
+            effect = registry.create(effect_name, devices=args.device, params=params)
+            engine.add_layer(Layer(effect, blend=args.blend if i > 0 else None))
+
+        if len(engine.layers) == 0:
+            raise ValueError("Need at least an effect, available: {}".format(", ".join(registry.get_names())))
+
+        state = client.get_state()
+        # the devices stay connected while the effect runs, not reopened for every frame
+        client.open_devices()
+        try:
+            engine.run()
+        finally:
             try:
-                fx.run()
-            finally:
                 client.set_state(state)
+            finally:
+                client.close_devices()
 
+    @staticmethod
+    def handle_in_service(args, verbose=False):
+        """Starts or stops an effect rendered by the service, one call per device"""
+        if args.device is None:
+            raise ValueError("Need at least a device")
+
+        client = glight.GlightClient(verbose=verbose)
+        client.connect()
+
+        if args.stop:
+            for device in args.device:
+                client.stop_effect(device)
+            return
+
+        if args.effect is None or len(args.effect) != 1:
+            raise ValueError("The service renders exactly one effect per device, available: {}".format(
+                ", ".join(client.list_effects())))
+
+        params = GlightFxApp.get_params(args)
+        if args.fps is not None:
+            params["fps"] = args.fps
+        for device in args.device:
+            client.start_effect(device, args.effect[0], params)
+
+    @staticmethod
+    def get_params(args):
+        """
+        :return: dict effect parameters of the command line
+        """
+        params = dict(param.split("=", 1) for param in args.param or [])
+        if args.smoothing is not None:
+            params["smoothing"] = args.smoothing
+        if args.decimation is not None:
+            params["decimation"] = args.decimation
+        return params
 
     @staticmethod
     def handle_experiments(args, verbose=False):
         if args.experimental == "test":
             src = CpuLoadSource()
+            sleep(0.1)
             print(src.read_cpu_usage())
         if args.experimental == "color":
             print(ColorUtils.col_hex_to_triplet("abcdef"))
@@ -148,6 +148,7 @@ class GlightUi:
     def setup_backend(self):
         self.proxy = glight.GlightController(self.backend_type)
         self.registry = glight.GDeviceRegistry()
+        self.proxy.watch_state(self.on_state_changed)
 
     def sync_ui(self):
         self.device_store.clear()
@@ -257,7 +258,7 @@ class GlightUi:
 
     def on_restore_settings(self, *args, **kwargs):
         """"""
-        state = self.proxy.get_state()
+        state = self.proxy.get_cached_state()
         print(state)
         self.proxy.load_state()
 
@@ -309,7 +310,7 @@ class GlightUi:
         if response == Gtk.ResponseType.OK:
             print("File selected: " + dialog.get_filename())
 
-            state = self.proxy.get_state()
+            state = self.proxy.get_cached_state()
             state_json = self.proxy.convert_state_to_json(state)
 
             filename = dialog.get_filename()
@@ -350,10 +351,16 @@ class GlightUi:
         else:
             self.selected_device = None
 
-        self.device_states = self.proxy.get_state()
+        self.device_states = self.proxy.get_cached_state()
 
         self.update_ui()
 
+    def on_state_changed(self, device_name, delta):
+        """Keeps the ui in sync with changes made by other clients of the service"""
+        self.device_states = self.proxy.get_cached_state()
+        if device_name == self.selected_device:
+            self.update_ui()
+
     def on_color_change(self, btn):
         """
         :param btn: Gtk.ColorButton
@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import shutil
+import subprocess
+import unittest
+from time import sleep, monotonic
+
+import glight
+import glight_fx
+
+# Usage: python -m glight_benchmarks
+#
+# Runs the command pipeline against fake devices (glight.UsbBackendFake), so no hardware is needed.
+# GLIGHT_BENCHMARK_ITERATIONS sets the number of operations per benchmark.
+
+iterations = int(os.environ.get("GLIGHT_BENCHMARK_ITERATIONS", "200"))
+
+
+class BenchmarkResult(object):
+    """Latencies of the operations of a benchmark in seconds"""
+
+    def __init__(self, name):
+        """"""
+        self.name = name
+        self.latencies = []
+        self.duration = 0.0
+
+    def get_ops_per_second(self):
+        if self.duration <= 0:
+            return 0.0
+        return len(self.latencies) / self.duration
+
+    def get_percentile(self, percentile):
+        """
+        :param percentile: float 0..100
+        :return: float seconds
+        """
+        if len(self.latencies) == 0:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
+    def __str__(self):
+        return "{:<36} {:>10.1f} ops/s  p50:{:>8.3f}ms  p90:{:>8.3f}ms  p99:{:>8.3f}ms  max:{:>8.3f}ms".format(
+            self.name, self.get_ops_per_second(),
+            self.get_percentile(50) * 1000, self.get_percentile(90) * 1000,
+            self.get_percentile(99) * 1000, self.get_percentile(100) * 1000)
+
+
+def run_benchmark(name, operation, count=None, warmup=10):
+    """
+    :param operation: callable taking the number of the operation
+    :param count: int operations to measure, defaults to iterations
+    :param warmup: int operations run before measuring, e.g. to fill caches
+    :return: BenchmarkResult
+    """
+    count = count or iterations
+    for i in range(0, warmup):
+        operation(i)
+
+    result = BenchmarkResult(name)
+    started_at = monotonic()
+    for i in range(0, count):
+        op_started_at = monotonic()
+        operation(i)
+        result.latencies.append(monotonic() - op_started_at)
+    result.duration = monotonic() - started_at
+
+    print(result)
+    return result
+
+
+def get_fake_device(device, latency=0.0, ack_delay=0.0, acknowledge=True):
+    """
+    :param device: glight.GDevice created with glight.UsbBackend.TYPE_FAKE
+    :return: glight.UsbBackendFake
+    """
+    device._init_backend()
+    backend = device.backend  # type: glight.UsbBackendFake
+    backend.latency = latency
+    backend.ack_delay = ack_delay
+    backend.acknowledge = acknowledge
+    return backend
+
+
+class TestUsbBackendFake(unittest.TestCase):
+
+    def setUp(self):
+        self.device = glight.G213(glight.UsbBackend.TYPE_FAKE)
+        self.backend = get_fake_device(self.device)
+
+    def test_records_packets(self):
+        self.device.connect()
+        try:
+            self.device.send_colors_command(["ff0000"])
+            self.device.send_colors_command(["ff0000"])
+        finally:
+            self.device.disconnect()
+
+        # prepare and color command, the unchanged color is not sent again
+        self.assertEqual(len(self.backend.get_packets()), 2)
+        self.assertTrue(self.backend.get_packets()[1].startswith("11ff0c3a0001ff0000"))
+
+    def test_acknowledges_packets(self):
+        self.backend.ack_delay = 0.002
+        self.device.connect()
+        try:
+            started_at = monotonic()
+            self.device.send_colors_command(["00ff00"])
+            self.assertLess(monotonic() - started_at, self.device.timeout_interrupt)
+        finally:
+            self.device.disconnect()
+        self.assertEqual(self.device.pacer.missed, 0)
+
+    def test_missing_acknowledgement(self):
+        self.backend.acknowledge = False
+        self.device.timeout_interrupt = 0.01
+        self.device.connect()
+        try:
+            self.device.send_colors_command(["0000ff"])
+        finally:
+            self.device.disconnect()
+        self.assertGreater(self.device.pacer.missed, 0)
+
+    def test_fixed_pacing_without_acknowledgements(self):
+        self.backend.acknowledge = False
+        self.device.connect()
+        try:
+            self.device.send_colors_command(["ff0000", "00ff00", "0000ff", "ffff00", "00ffff", "ff00ff"])
+            self.assertEqual(self.device.pacing, glight.GDevice.PACING_FIXED)
+            self.assertEqual(self.device.pacer.missed, self.device.pacer.max_missed_in_row)
+
+            started_at = monotonic()
+            self.device.send_colors_command(["ff00ff", "00ffff", "ffff00", "0000ff", "00ff00", "ff0000"])
+            self.assertLess(monotonic() - started_at, self.device.timeout_interrupt)
+        finally:
+            self.device.disconnect()
+
+    def test_failed_send_cancels_interrupt(self):
+        self.device.connect()
+        try:
+            self.backend.present = False
+            self.backend.device = None
+            with self.assertRaises(ValueError):
+                self.device.send_colors_command(["0000ff"])
+            self.assertIsNone(self.device.interrupt_transfer)
+            self.assertIsNone(self.backend.transfer)
+        finally:
+            self.device.disconnect()
+
+    def test_failed_interrupt_transfer(self):
+        self.backend.ack_status = glight.usb1.TRANSFER_ERROR
+        self.device.connect()
+        try:
+            self.device.send_colors_command(["0000ff"])
+        finally:
+            self.device.disconnect()
+        self.assertGreater(self.device.pacer.missed, 0)
+
+    def test_absent_device(self):
+        self.backend.present = False
+        self.assertFalse(self.device.exists())
+        with self.assertRaises(ValueError):
+            self.device.connect()
+
+
+class TestGlightBenchmarks(unittest.TestCase):
+
+    colors = ["ff0000", "00ff00", "0000ff", "ffff00", "00ffff", "ff00ff"]
+
+    def setUp(self):
+        print("")
+
+    def get_field_colors(self, i):
+        """Six field colors of which two change per operation"""
+        colors = list(self.colors)
+        colors[i % 6] = "{:06x}".format((i * 7919) & 0xffffff)
+        colors[(i + 3) % 6] = "{:06x}".format((i * 104729) & 0xffffff)
+        return colors
+
+    def test_command_encoding(self):
+        device = glight.G213(glight.UsbBackend.TYPE_FAKE)
+        command = device.get_command("color")
+
+        run_benchmark("encode color command (cached)", lambda i: command.build(
+            field=i % 7, color=device.color_spec.clamp_color_hex(self.colors[i % 6])))
+        run_benchmark("encode color command (uncached)", lambda i: command.build(
+            field=i % 7, color=device.color_spec.clamp_color_hex("{:06x}".format(i * 7919 & 0xffffff))))
+
+        registry = glight.GDeviceRegistry(backend_type=glight.UsbBackend.TYPE_FAKE)
+        for known_device in registry.known_devices:
+            known_device.device_state.import_dict({"colors": list(self.colors), "static": True})
+        states = registry.get_state_of_devices()
+        run_benchmark("encode binary state", lambda i: glight.GDeviceStateCodec.encode(states))
+        run_benchmark("encode json state", lambda i: registry.get_state_as_json())
+
+    def test_send_colors_command(self):
+        device = glight.G213(glight.UsbBackend.TYPE_FAKE)
+        backend = get_fake_device(device)
+        device.connect()
+        try:
+            run_benchmark("send_colors_command uniform", lambda i: device.send_colors_command([self.colors[i % 6]]))
+            run_benchmark("send_colors_command fields", lambda i: device.send_colors_command(self.get_field_colors(i)))
+
+            backend.latency = 0.0005
+            backend.ack_delay = 0.001
+            result = run_benchmark("send_colors_command fields (slow usb)",
+                                   lambda i: device.send_colors_command(self.get_field_colors(i)), count=iterations // 4)
+        finally:
+            device.disconnect()
+
+        self.assertGreater(len(backend.get_packets()), 0)
+        self.assertGreater(result.get_percentile(50), backend.latency)
+
+    def test_restore_state(self):
+        registry = glight.GDeviceRegistry(backend_type=glight.UsbBackend.TYPE_FAKE)
+        for known_device in registry.known_devices:
+            get_fake_device(known_device, latency=0.0005, ack_delay=0.001)
+
+        def restore(i):
+            registry.set_state_of_devices(dict(
+                (known_device.device_name_short, {"colors": self.get_field_colors(i), "colors_uniform": False,
+                                                  "static": True, "breathing": False, "cycling": False})
+                for known_device in registry.known_devices))
+            registry.restore_states_of_devices()
+
+        run_benchmark("restore_states_of_devices", restore, count=iterations // 4)
+
+    def test_service_commands(self):
+        service = glight.GlightService(backend_type=glight.UsbBackend.TYPE_FAKE)
+        device_name = glight.G213().device_name_short
+        try:
+            run_benchmark("service set_frame", lambda i: service.run_frame_on_device(
+                device_name, {1 + i % 6: self.colors[i % 6]}))
+            run_benchmark("service set_colors_nowait", lambda i: service.set_colors_nowait(
+                device_name, self.get_field_colors(i)))
+            run_benchmark("service get_device_state", lambda i: service.get_device_state(device_name))
+            run_benchmark("service get_stats", lambda i: service.get_stats())
+            stats = json.loads(service.get_stats())
+        finally:
+            service.stop_workers()
+
+        self.assertGreater(stats[device_name]["executed"], 0)
+
+    def test_service_round_trips(self):
+        """Runs a service with fake devices on a private session bus"""
+        dbus_daemon = shutil.which("dbus-daemon")
+        if dbus_daemon is None:
+            self.skipTest("dbus-daemon not found")
+        if not hasattr(glight, "SessionBus"):
+            self.skipTest("pydbus not installed")
+
+        bus_daemon = subprocess.Popen([dbus_daemon, "--session", "--nofork", "--print-address"],
+                                      stdout=subprocess.PIPE, universal_newlines=True)
+        bus_address = os.environ.get("DBUS_SESSION_BUS_ADDRESS")
+        service = None
+        try:
+            os.environ["DBUS_SESSION_BUS_ADDRESS"] = bus_daemon.stdout.readline().strip()
+            service = subprocess.Popen([sys.executable, glight.__file__, "--service", "--backend", "fake",
+                                        "--session-bus"],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            glight.GlightRemoteCommon.use_session_bus = True
+            client = glight.GlightClient()
+            deadline = monotonic() + 10
+            while True:
+                try:
+                    client.connect()
+                    client.echo(0)
+                    break
+                except Exception:
+                    if service.poll() is not None:
+                        # e.g. GLib or the gi bindings pydbus needs are missing
+                        self.skipTest("service exited with {}".format(service.returncode))
+                    if monotonic() > deadline:
+                        raise
+                    sleep(0.1)
+
+            device_name = glight.G213().device_name_short
+            run_benchmark("dbus echo", lambda i: client.echo(i))
+            run_benchmark("dbus get_state", lambda i: client.get_state())
+            run_benchmark("dbus get_device_state", lambda i: client.get_device_state(device_name))
+            run_benchmark("dbus set_colors_nowait", lambda i: client.set_colors_nowait(
+                device_name, self.get_field_colors(i)))
+            run_benchmark("dbus set_colors", lambda i: client.set_colors(device_name, self.get_field_colors(i)),
+                          count=iterations // 4)
+
+            client.proxy.quit()
+        finally:
+            glight.GlightRemoteCommon.use_session_bus = False
+            if bus_address is None:
+                os.environ.pop("DBUS_SESSION_BUS_ADDRESS", None)
+            else:
+                os.environ["DBUS_SESSION_BUS_ADDRESS"] = bus_address
+            if service is not None:
+                try:
+                    service.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    service.terminate()
+                    service.wait()
+            bus_daemon.terminate()
+            bus_daemon.wait()
+
+    def test_effect_frame_rate(self):
+        service = glight.GlightService(backend_type=glight.UsbBackend.TYPE_FAKE)
+        device_name = glight.G213().device_name_short
+        registry = glight_fx.EffectRegistry.get_default()
+
+        engine = glight_fx.EffectEngine(glight.GEffectClient(service))
+        engine.add_layer(glight_fx.Layer(registry.create("solid", devices=[device_name],
+                                                         params={"color": "202020"})))
+        engine.add_layer(glight_fx.Layer(registry.create("cpux", devices=[device_name]),
+                                         blend=glight_fx.Layer.BLEND_ADD))
+        try:
+            # run() keeps the effects set up here and tears them down
+            engine.setup()
+            run_benchmark("effect render", lambda i: engine.render(i / 30.0))
+            run_benchmark("effect render and send", lambda i: engine.send(engine.render(i / 30.0)))
+
+            engine.fps = 120
+            started_at = monotonic()
+            engine.run(max_frames=iterations)
+            duration = monotonic() - started_at
+        finally:
+            engine.teardown()
+            service.stop_workers()
+
+        stats = engine.loop.stats
+        print("{:<36} {:>10.1f} fps (target {}) {}".format(
+            "effect frame loop", stats.frames / duration, engine.fps, stats))
+        self.assertEqual(stats.frames, iterations)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from threading import Event, Thread
+from time import sleep
+
+import glight
+
+# Usage: python -m glight_device_unittests
+#
+# Runs against fake devices (glight.UsbBackendFake), so no hardware is needed.
+
+
+class TestGDeviceDifferentialUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.device = glight.G213(glight.UsbBackend.TYPE_FAKE)
+        self.device._init_backend()
+        self.backend = self.device.backend  # type: glight.UsbBackendFake
+        self.device.connect()
+
+    def tearDown(self):
+        self.device.disconnect()
+
+    def get_color_packets(self):
+        """
+        :return: (field, color)[] of the sent color commands
+        """
+        prefix = "11ff0c3a"
+        return [(int(packet[8:10], 16), packet[12:18]) for packet in self.backend.get_packets()
+                if packet.startswith(prefix)]
+
+    def test_unchanged_fields_are_skipped(self):
+        colors = ["ff0000", "00ff00", "0000ff", "ffff00", "00ffff", "ff00ff"]
+        self.device.send_colors_command(colors)
+        self.backend.clear_packets()
+
+        colors[2] = "ffffff"
+        self.device.send_colors_command(colors)
+        self.assertEqual(self.get_color_packets(), [(3, "ffffff")])
+
+    def test_imported_colors_are_not_confirmed(self):
+        colors = ["ff0000", "00ff00", "0000ff", "ffff00", "00ffff", "ff00ff"]
+        self.device.device_state.import_dict({"colors": [None] + colors, "static": True, "colors_uniform": False})
+
+        # a single field command must not mark the imported colors of the other fields as shown
+        self.device.send_field_colors({1: "ff0000"})
+        self.backend.clear_packets()
+
+        self.device.send_colors_command(colors)
+        self.assertEqual([field for field, color in self.get_color_packets()], [2, 3, 4, 5, 6])
+
+    def test_effect_forgets_field_colors(self):
+        self.device.send_colors_command(["ff0000"])
+        self.device.send_cycle_command(2000)
+        self.backend.clear_packets()
+
+        self.device.send_colors_command(["ff0000"])
+        self.assertEqual(self.get_color_packets(), [(0, "ff0000")])
+
+    def test_failed_command_forgets_shown_state(self):
+        self.device.send_colors_command(["ff0000"])
+        self.device.disconnect()
+        with self.assertRaises(ValueError):
+            self.device.send_colors_command(["00ff00"])
+        self.assertEqual(self.device.shown_colors, {})
+
+
+class TestGDeviceConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.device = glight.G213(glight.UsbBackend.TYPE_FAKE)
+        self.device._init_backend()
+        self.backend = self.device.backend  # type: glight.UsbBackendFake
+
+    def test_probe_waits_for_connect(self):
+        connecting = Event()
+        connect = self.backend.connect
+
+        def slow_connect(device=None):
+            connecting.set()
+            sleep(0.05)
+            return connect(device)
+
+        probes = []
+        get_usb_device = self.backend.get_usb_device
+
+        def probe():
+            probes.append(True)
+            return get_usb_device()
+
+        self.backend.connect = slow_connect
+        self.backend.get_usb_device = probe
+
+        thread = Thread(target=self.device.connect)
+        thread.start()
+        connecting.wait()
+        try:
+            # e.g. a rescan, which must not open a second handle while a worker connects
+            self.assertTrue(self.device.exists())
+            self.assertEqual(probes, [])
+        finally:
+            thread.join()
+            self.device.disconnect()
+
+
+class TestGDeviceApplyState(unittest.TestCase):
+
+    state = {"colors": ["ff0000"], "colors_uniform": True, "static": True, "breathing": False, "cycling": False}
+
+    def setUp(self):
+        self.device = glight.G213(glight.UsbBackend.TYPE_FAKE)
+        self.device._init_backend()
+
+    def test_unchanged_state_is_not_restored(self):
+        self.assertTrue(self.device.apply_state(self.state))
+        self.device.restore_state()
+        self.assertFalse(self.device.apply_state(self.state))
+
+    def test_unconfirmed_state_is_restored(self):
+        self.assertTrue(self.device.apply_state(self.state))
+        # e.g. the restore failed, the state is not shown yet
+        self.assertTrue(self.device.apply_state(self.state))
+
+        self.device.restore_state()
+        # e.g. the device has been replugged
+        self.device.forget_shown_state()
+        self.assertTrue(self.device.apply_state(self.state))
+
+    def test_failed_import_keeps_the_state(self):
+        self.device.apply_state(self.state)
+        previous = self.device.device_state.as_dict()
+        with self.assertRaises(Exception):
+            self.device.apply_state({"static": False, "colors": 5})
+        self.assertEqual(self.device.device_state.as_dict(), previous)
+
+    def test_state_object_is_applied(self):
+        state = glight.GDeviceState().import_dict(self.state)
+        self.assertTrue(self.device.apply_state(state))
+        self.assertEqual(self.device.device_state.colors[0], "ff0000")
+
+
+class TestGlightControllerState(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = glight.GlightController(glight.GlightController.BACKEND_LOCAL)
+        self.controller.device_registry = glight.GDeviceRegistry(backend_type=glight.UsbBackend.TYPE_FAKE)
+        self.device_name = glight.G213().device_name_short
+
+    def test_get_state_set_state_round_trip(self):
+        """e.g. glight_fx restores the state from before an effect"""
+        self.controller.set_colors(self.device_name, ["ff0000"])
+        state = self.controller.get_state()
+
+        self.controller.set_colors(self.device_name, ["00ff00"])
+        self.controller.set_state(state)
+
+        device = self.controller.device_registry.get_known_device(self.device_name)
+        self.assertEqual(device.device_state.colors[0], "ff0000")
+        self.assertTrue(device.backend.get_packets()[-1].startswith("11ff0c3a0001ff0000"))
+
+    def test_open_devices_keep_the_connection(self):
+        """e.g. glight_fx sends a frame per tick"""
+        self.controller.open_devices()
+        device = self.controller.get_device(self.device_name)
+        try:
+            self.controller.set_frame(self.device_name, {0: "ff0000"})
+            prepared_mode = device.prepared_mode
+            self.controller.set_frame(self.device_name, {0: "00ff00"})
+            self.assertTrue(device.is_connected)
+            self.assertEqual(device.prepared_mode, prepared_mode)
+        finally:
+            self.controller.close_devices()
+        self.assertFalse(device.is_connected)
+
+
+class TestGlightServiceState(unittest.TestCase):
+
+    def setUp(self):
+        self.service = glight.GlightService(backend_type=glight.UsbBackend.TYPE_FAKE)
+        self.device_name = glight.G213().device_name_short
+
+    def tearDown(self):
+        self.service.stop_workers()
+
+    def test_state_is_answered_during_restore(self):
+        self.service.set_colors(self.device_name, ["ff0000"])
+
+        # e.g. a restore, which holds the registry lock for writing while it talks to the devices
+        with self.service.registry_lock.writing():
+            state = json.loads(self.service.get_state())
+            device_state = json.loads(self.service.get_device_state(self.device_name))
+            self.assertTrue(self.service.on_idle_check())
+
+        self.assertEqual(state[self.device_name]["colors"][0], "ff0000")
+        self.assertEqual(device_state["colors"][0], "ff0000")
+
+
+class TestGDeviceRegistryStateFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "state" + glight.GDeviceRegistry.STATE_FILE_EXTENSION)
+        self.registry = glight.GDeviceRegistry(backend_type=glight.UsbBackend.TYPE_FAKE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_mode_is_kept(self):
+        self.registry.write_state_of_devices(self.filename)
+        os.chmod(self.filename, 0o640)
+        self.registry.write_state_of_devices(self.filename, force=True)
+        self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0o640)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.filename)])
+
+    def test_other_format_is_converted(self):
+        self.registry.write_state_of_devices(self.filename)
+        self.registry.load_state_of_devices(self.filename)
+
+        self.registry.state_format = glight.GDeviceStateCodec.FORMAT_BINARY
+        self.assertTrue(self.registry.write_state_of_devices(self.filename))
+        with open(self.filename, "rb") as fh:
+            self.assertTrue(glight.GDeviceStateCodec.is_binary(fh.read()))
+        self.assertFalse(self.registry.write_state_of_devices(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import colorsys
+import unittest
+from threading import Thread
+from time import monotonic
+
+import glight
+import glight_fx
+
+# Usage: python -m glight_fx_unittests
+#
+# Renders the effects without devices, the frames are validated like the devices of the service do.
+
+
+class TestColorUtils(unittest.TestCase):
+    """The batch functions have to give the same colors as colorsys and the functions for single colors"""
+
+    rgbs = [(0.0, 0.0, 0.0), (1.0, 1.0, 1.0), (0.5, 0.5, 0.5), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0),
+            (1.0, 1.0, 0.0), (0.2, 0.4, 0.6), (0.9, 0.1, 0.5), (0.3, 0.05, 0.0), (0.0, 0.7, 0.69)]
+
+    def setUp(self):
+        self.numpy = glight_fx.numpy
+
+    def tearDown(self):
+        glight_fx.numpy = self.numpy
+
+    def run_with_and_without_numpy(self, test):
+        test()
+        if self.numpy is not None:
+            glight_fx.numpy = None
+            test()
+            glight_fx.numpy = self.numpy
+
+    def assert_triplets_equal(self, triplets_a, triplets_b):
+        self.assertEqual(len(triplets_a), len(triplets_b))
+        for triplet_a, triplet_b in zip(triplets_a, triplets_b):
+            for a, b in zip(triplet_a, triplet_b):
+                self.assertAlmostEqual(a, b, places=9)
+
+    def test_cols_hex_to_triplets(self):
+        hexes = [glight_fx.ColorUtils.col_triplet_to_hex(rgb) for rgb in self.rgbs] + ["ABCDEF", "f", ""]
+        self.run_with_and_without_numpy(lambda: self.assert_triplets_equal(
+            glight_fx.ColorUtils.cols_hex_to_triplets(hexes),
+            [glight_fx.ColorUtils.col_hex_to_triplet(col_hex) for col_hex in hexes]))
+
+    def test_rgbs_to_hsvs(self):
+        self.run_with_and_without_numpy(lambda: self.assert_triplets_equal(
+            glight_fx.ColorUtils.rgbs_to_hsvs(self.rgbs), [colorsys.rgb_to_hsv(*rgb) for rgb in self.rgbs]))
+
+    def test_hsvs_to_rgbs(self):
+        hsvs = [colorsys.rgb_to_hsv(*rgb) for rgb in self.rgbs] + [(i / 12.0, 0.8, 0.9) for i in range(0, 13)]
+        self.run_with_and_without_numpy(lambda: self.assert_triplets_equal(
+            glight_fx.ColorUtils.hsvs_to_rgbs(hsvs), [colorsys.hsv_to_rgb(*hsv) for hsv in hsvs]))
+
+    def test_cols_triplets_to_hex(self):
+        self.run_with_and_without_numpy(lambda: self.assertEqual(
+            glight_fx.ColorUtils.cols_triplets_to_hex(self.rgbs),
+            [glight_fx.ColorUtils.col_triplet_to_hex(rgb) for rgb in self.rgbs]))
+
+    def test_color_lerp_batch(self):
+        values = [i / 10.0 for i in range(0, 11)]
+        for rgb_start, rgb_end in zip(self.rgbs, reversed(self.rgbs)):
+            self.run_with_and_without_numpy(lambda: self.assert_triplets_equal(
+                glight_fx.ColorUtils.color_lerp_batch(values, 1.0, rgb_start, rgb_end),
+                [glight_fx.ColorUtils.color_lerp(val, 1.0, rgb_start, rgb_end) for val in values]))
+
+    def test_compiled_color_scale(self):
+        scale = glight_fx.ColorScale(lut_size=101)
+        scale.add_point(0.0, "0000ff")
+        scale.add_point(40.0, "00ff00")
+        scale.add_point(40.0, "ffff00")
+        scale.add_point(100.0, "ff0000")
+
+        def test():
+            scale.compile()
+            self.assertEqual(scale.lut, [scale.get_color_hex(val, None) for val in range(0, 101)])
+
+        self.run_with_and_without_numpy(test)
+
+
+class FixedSource(glight_fx.ValueSource):
+    """Returns the given values"""
+
+    def __init__(self, values, value_range=(0.0, 100.0)):
+        """"""
+        super(FixedSource, self).__init__()
+        self.values = values
+        self.value_range = value_range
+
+    def get_dimensions(self):
+        return len(self.values)
+
+    def get_value_range(self, dimension=0):
+        return self.value_range
+
+    def get_value(self):
+        return self.values
+
+
+class TestEffectFields(unittest.TestCase):
+
+    devices = [glight.G203(), glight.G213()]
+
+    def assert_valid_frames(self, frame):
+        for device in self.devices:
+            self.assertIn(device.device_name_short, frame)
+            device.assert_valid_frame(frame[device.device_name_short], glight.GDevice.MODE_STATIC)
+
+    def create_effect(self, name, values):
+        effect = glight_fx.EffectRegistry.get_default().create(
+            name, devices=[device.device_name_short for device in self.devices])
+        effect.setup()
+        effect.vsrc = FixedSource(values)
+        return effect
+
+    def test_fold_values(self):
+        self.assertEqual(glight_fx.Effect.fold_values([10.0, 20.0], 6), [10.0, 20.0])
+        self.assertEqual(glight_fx.Effect.fold_values([0.0, 10.0, 20.0, 30.0], 2), [5.0, 25.0])
+        self.assertEqual(glight_fx.Effect.fold_values([0.0, 10.0, 20.0, 30.0], 0), [15.0])
+        self.assertEqual(glight_fx.Effect.fold_values([0.0, 10.0, 20.0], None), [0.0, 10.0, 20.0])
+        self.assertEqual(len(glight_fx.Effect.fold_values([1.0] * 8, 6)), 6)
+
+    def test_cpux_with_more_cpus_than_fields(self):
+        effect = self.create_effect("cpux", [0.0, 100.0] * 4)
+        frame = effect.render(0.0)
+        self.assert_valid_frames(frame)
+        self.assertEqual(len(frame["g213"]), 6)
+        self.assertEqual(list(frame["g203"].keys()), [0])
+
+    def test_cpux_with_less_cpus_than_fields(self):
+        effect = self.create_effect("cpux", [0.0, 100.0])
+        frame = effect.render(0.0)
+        self.assert_valid_frames(frame)
+        self.assertEqual(frame["g213"], {1: "0000ff", 2: "ff0000"})
+
+    def test_meter_with_more_values_than_fields(self):
+        effect = self.create_effect("meter", [10.0 * i for i in range(0, 8)])
+        frame = effect.render(0.0)
+        self.assert_valid_frames(frame)
+        self.assertEqual(len(frame["g213"]), 6)
+        self.assertEqual(list(frame["g203"].keys()), [0])
+
+    def test_meter_with_one_value(self):
+        effect = self.create_effect("meter", 50.0)
+        frame = effect.render(0.0)
+        self.assert_valid_frames(frame)
+        self.assertEqual(list(frame["g213"].keys()), [0])
+
+
+class TestEffectEngine(unittest.TestCase):
+
+    class FrameEffect(glight_fx.Effect):
+        """Renders the frame given as param"""
+
+        def render(self, t):
+            return dict((device, self.params) for device in self.devices)
+
+    def render(self, frames, blend):
+        engine = glight_fx.EffectEngine(None)
+        for i, frame in enumerate(frames):
+            engine.add_layer(glight_fx.Layer(TestEffectEngine.FrameEffect(devices=["g213"], params=frame),
+                                             blend=glight_fx.Layer.BLEND_NORMAL if i == 0 else blend))
+        return engine.render(0.0)["g213"]
+
+    def test_whole_device_layer_blends_into_fields(self):
+        frame = self.render([{1: "100000", 2: "001000"}, {0: "000010"}], glight_fx.Layer.BLEND_ADD)
+        self.assertEqual(frame, {0: "000010", 1: "100010", 2: "001010"})
+
+        frame = self.render([{0: "100000", 3: "001000"}, {0: "000010"}], glight_fx.Layer.BLEND_ADD)
+        self.assertEqual(frame, {0: "100010", 3: "001010"})
+
+    def test_field_layer_blends_into_whole_device(self):
+        frame = self.render([{0: "100000"}, {2: "000010"}], glight_fx.Layer.BLEND_ADD)
+        self.assertEqual(frame, {0: "100000", 2: "100010"})
+
+    def test_engines_do_not_share_samplers(self):
+        """e.g. the service runs an engine per device, each on a thread of its own"""
+        effects = [glight_fx.EffectRegistry.get_default().create("cpux", devices=["g213"]) for i in range(0, 2)]
+        engines = [glight_fx.EffectEngine(None) for effect in effects]
+        for engine, effect in zip(engines, effects):
+            engine.add_layer(glight_fx.Layer(effect))
+            engine.setup()
+            self.assertIs(effect.vsrc.sampler, engine.sampler)
+        self.assertIsNot(engines[0].sampler, engines[1].sampler)
+        self.assertIsNot(engines[0].sampler, glight_fx.Sampler.get_default())
+
+
+class TestFrameLoop(unittest.TestCase):
+
+    def test_stop_wakes_the_loop(self):
+        loop = glight_fx.FrameLoop(fps=0.5)
+        thread = Thread(target=loop.run, args=(lambda t: {}, lambda frame: None))
+        thread.start()
+        while loop.stats.frames == 0:
+            thread.join(0.01)
+
+        started_at = monotonic()
+        loop.stop()
+        thread.join()
+        self.assertLess(monotonic() - started_at, 0.5)
+        self.assertEqual(loop.stats.frames, 1)
+
+    def test_stop_before_run(self):
+        engine = glight_fx.EffectEngine(None, fps=0.5)
+        engine.stop()
+        engine.run()
+        self.assertEqual(engine.loop.stats.frames, 0)
+
+
+class TestServiceEffects(unittest.TestCase):
+
+    def setUp(self):
+        self.service = glight.GlightService(backend_type=glight.UsbBackend.TYPE_FAKE)
+        self.device_name = glight.G213().device_name_short
+
+    def tearDown(self):
+        self.service.stop_effects()
+        self.service.stop_workers()
+
+    def test_failed_setup_is_reported(self):
+        with self.assertRaises(glight.GDeviceException):
+            self.service.start_effect(self.device_name, "animation", "{}")
+        self.assertNotIn(self.device_name, self.service.effects)
+
+    def test_start_and_stop_effect(self):
+        self.service.start_effect(self.device_name, "cpux", "{}")
+        self.assertTrue(self.service.effects[self.device_name].is_running())
+        self.service.stop_effect(self.device_name)
+        self.assertNotIn(self.device_name, self.service.effects)
+
+
+if __name__ == '__main__':
+    unittest.main()